@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import random
+import subprocess
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, cast
+
+START_TIMESTAMP = 1_600_000_000
+# Spread commits over several days, so that daily sampling has work to do.
+COMMIT_INTERVAL = 6 * 60 * 60
+
+EXTENSIONS = (".c", ".h", ".py", ".md", ".txt")
+WORDS = ("foo", "bar", "baz", "value", "result", "count", "index", "buffer")
+
+
+@dataclass
+class RepositoryParameters:
+    commits: int = 200
+    files: int = 500
+    # Average size of each file in bytes.
+    file_size: int = 2000
+    # Fraction of files modified by each commit.
+    churn: float = 0.02
+    seed: int = 0
+
+
+def _generate_line(rng: random.Random, extension: str) -> str:
+    words = " ".join(rng.choices(WORDS, k=rng.randint(1, 8)))
+    match rng.random():
+        case roll if roll < 0.02:
+            marker = "#" if extension == ".py" else "//"
+            return f"{marker} TODO: {words}"
+        case roll if roll < 0.15:
+            return f"# {words}" if extension == ".py" else f"/* {words} */"
+        case roll if roll < 0.25:
+            return ""
+        case roll if roll < 0.35:
+            return f"if ({words}) {{"
+        case _:
+            return f"    {words};"
+
+
+def generate_content(rng: random.Random, extension: str, size: int) -> bytes:
+    lines = []
+    length = 0
+    # Sizes vary between half and one and a half times the average.
+    target = rng.randint(size // 2, size * 3 // 2)
+    while length < target:
+        line = _generate_line(rng, extension)
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines).encode() + b"\n"
+
+
+def _write_data(stream: IO[bytes], data: bytes) -> None:
+    stream.write(f"data {len(data)}\n".encode())
+    stream.write(data)
+    stream.write(b"\n")
+
+
+def generate_repository(path: Path, parameters: RepositoryParameters) -> None:
+    # Same parameters, same repository (including commit hashes).
+    rng = random.Random(parameters.seed)
+    path.mkdir(parents=True)
+    subprocess.run(
+        ["git", "init", "--quiet", "--initial-branch=main", str(path)], check=True
+    )
+    # Generated with fast-import in a single process, much faster than a git
+    # commit per commit.
+    process = subprocess.Popen(
+        ["git", "-C", str(path), "fast-import", "--quiet"],
+        stdin=subprocess.PIPE,
+    )
+    stream = cast(IO[bytes], process.stdin)
+
+    paths = [
+        f"src/d{index % 20}/file{index}{rng.choice(EXTENSIONS)}"
+        for index in range(parameters.files)
+    ]
+    next_index = parameters.files
+    for commit in range(parameters.commits):
+        timestamp = START_TIMESTAMP + commit * COMMIT_INTERVAL
+        stream.write(b"commit refs/heads/main\n")
+        stream.write(f"mark :{commit + 1}\n".encode())
+        stream.write(
+            f"committer Bench <bench@example.com> {timestamp} +0000\n".encode()
+        )
+        message = f"Commit {commit}" + (" (TODO: clean up)" if commit % 7 == 0 else "")
+        _write_data(stream, message.encode())
+        if commit:
+            stream.write(f"from :{commit}\n".encode())
+            changed_paths = rng.sample(
+                paths, max(1, round(len(paths) * parameters.churn))
+            )
+            # Occasionally replace a file by a new one, for removals and renames.
+            if rng.random() < 0.1:
+                removed_path = rng.choice(paths)
+                stream.write(f"D {removed_path}\n".encode())
+                paths.remove(removed_path)
+                new_path = removed_path.rsplit("/", 1)[0] + (
+                    f"/file{next_index}{rng.choice(EXTENSIONS)}"
+                )
+                next_index += 1
+                paths.append(new_path)
+                changed_paths = [
+                    path for path in changed_paths if path != removed_path
+                ] + [new_path]
+        else:
+            changed_paths = paths
+        for changed_path in changed_paths:
+            stream.write(f"M 100644 inline {changed_path}\n".encode())
+            _write_data(
+                stream,
+                generate_content(rng, Path(changed_path).suffix, parameters.file_size),
+            )
+        stream.write(b"\n")
+
+    stream.close()
+    if process.wait():
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+    subprocess.run(["git", "-C", str(path), "reset", "--quiet", "--hard"], check=True)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Generate a synthetic git repository")
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--commits", type=int, default=RepositoryParameters.commits)
+    parser.add_argument("--files", type=int, default=RepositoryParameters.files)
+    parser.add_argument("--file-size", type=int, default=RepositoryParameters.file_size)
+    parser.add_argument("--churn", type=float, default=RepositoryParameters.churn)
+    parser.add_argument("--seed", type=int, default=RepositoryParameters.seed)
+    arguments = parser.parse_args()
+    generate_repository(
+        arguments.path,
+        RepositoryParameters(
+            commits=arguments.commits,
+            files=arguments.files,
+            file_size=arguments.file_size,
+            churn=arguments.churn,
+            seed=arguments.seed,
+        ),
+    )
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import json
+import platform
+import random
+import re
+import sys
+import time
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+from generate import EXTENSIONS, RepositoryParameters, generate_content
+
+# Run against the analyzers of this checkout.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stats.analyzers.grep import compile_pattern  # noqa: E402
+from stats.git import TrackedFile  # noqa: E402
+
+
+# (regex, case_insensitive), from plain words to actual regexes.
+PATTERNS = [
+    ("TODO", False),
+    (r"TODO\(", False),
+    ("todo|fixme", True),
+    (r"/\*", False),
+    ("foo|bar|baz", False),
+    (r"\bif\b", False),
+    (r"TODO:?\s", False),
+]
+
+
+def _measure(
+    count_matches: list[Callable[[bytes], int]], contents: list[bytes], repeat: int
+) -> list[tuple[float, int]]:
+    # Best of several runs of each function, taking turns so that they're equally
+    # affected by the machine's load and clock speed changing over time. The
+    # total number of matches must be the same for all runs.
+    best_seconds = [float("inf")] * len(count_matches)
+    totals = [0] * len(count_matches)
+    for _ in range(repeat):
+        for position, function in enumerate(count_matches):
+            start_time = time.perf_counter()
+            totals[position] = sum(map(function, contents))
+            best_seconds[position] = min(
+                best_seconds[position], time.perf_counter() - start_time
+            )
+    return list(zip(best_seconds, totals))
+
+
+@dataclass
+class FindallPattern:
+    # How grep counted matches before it had fast paths for literals.
+    pattern: re.Pattern[bytes]
+
+    def scan(self, file: TrackedFile, content: bytes) -> int:
+        return len(self.pattern.findall(content))
+
+
+def run_pattern(
+    regex: str, case_insensitive: bool, *, contents: list[bytes], repeat: int
+) -> dict[str, Any]:
+    findall_pattern = FindallPattern(
+        re.compile(regex.encode(), re.IGNORECASE if case_insensitive else re.NOFLAG)
+    )
+    # Generated files are never binary, don't spend any time checking.
+    pattern = compile_pattern(
+        files_glob=None,
+        regex=regex,
+        case_insensitive=case_insensitive,
+        binary_files=True,
+    )
+    file = TrackedFile(path="", blob_hash="")
+    (findall_seconds, findall_matches), (scan_seconds, scan_matches) = _measure(
+        [
+            lambda content: findall_pattern.scan(file, content),
+            lambda content: pattern.scan(file, content) or 0,
+        ],
+        contents,
+        repeat,
+    )
+    if scan_matches != findall_matches:
+        raise AssertionError(
+            f"{regex!r}: {scan_matches} matches instead of {findall_matches}"
+        )
+    megabytes = sum(map(len, contents)) / 1024 / 1024
+    return {
+        "regex": regex,
+        "case_insensitive": case_insensitive,
+        "literals": pattern.literals is not None,
+        "matches": scan_matches,
+        "findall_mb_per_second": round(megabytes / findall_seconds, 1),
+        "scan_mb_per_second": round(megabytes / scan_seconds, 1),
+        "speedup": round(findall_seconds / scan_seconds, 2),
+    }
+
+
+def main(
+    *, output: Path | None, files: int, file_size: int, seed: int, repeat: int
+) -> None:
+    rng = random.Random(seed)
+    contents = [
+        generate_content(rng, rng.choice(EXTENSIONS), file_size) for _ in range(files)
+    ]
+
+    results = []
+    for regex, case_insensitive in PATTERNS:
+        print(f"Running {regex!r}", file=sys.stderr)
+        result = run_pattern(regex, case_insensitive, contents=contents, repeat=repeat)
+        print(
+            f"{result['scan_mb_per_second']} MB/s, {result['speedup']}x re.findall",
+            file=sys.stderr,
+        )
+        results.append(result)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "files": files,
+        "file_size": file_size,
+        "seed": seed,
+        "results": results,
+    }
+    report_json = json.dumps(report, indent=2)
+    if output:
+        output.write_text(report_json + "\n")
+    else:
+        print(report_json)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Benchmark grep's pattern matching against re.findall"
+    )
+    parser.add_argument("-o", "--output", type=Path, help="Write JSON report here")
+    parser.add_argument("--files", type=int, default=RepositoryParameters.files)
+    parser.add_argument("--file-size", type=int, default=RepositoryParameters.file_size)
+    parser.add_argument("--seed", type=int, default=RepositoryParameters.seed)
+    parser.add_argument("--repeat", type=int, default=5)
+    arguments = parser.parse_args()
+    main(
+        output=arguments.output,
+        files=arguments.files,
+        file_size=arguments.file_size,
+        seed=arguments.seed,
+        repeat=arguments.repeat,
+    )
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from dataclasses import asdict, dataclass
+from multiprocessing import cpu_count
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
+
+from generate import RepositoryParameters, generate_repository
+
+
+MAIN_PATH = Path(__file__).resolve().parent.parent / "main.py"
+
+ANALYZERS: dict[str, dict[str, dict[str, Any]]] = {
+    "grep": {
+        "todos": {"type": "grep", "regex": "todo|fixme", "case_insensitive": True},
+        "ifs": {"type": "grep", "regex": r"\bif\b"},
+        "c_comments": {"type": "grep", "regex": r"/\*", "files_glob": "*.{c,h}"},
+    },
+    "loc": {"lines": {"type": "loc"}},
+    "scc": {"lines": {"type": "scc"}},
+    "grep_commits": {
+        "todos": {"type": "grep_commits", "regex": "todo", "case_insensitive": True}
+    },
+}
+CACHE_MODES = ("off", "cold", "warm")
+
+
+@dataclass
+class Case:
+    analyzers: str
+    cache: str
+    commit_sampling: str
+    processes: int
+    engine: str
+
+    @property
+    def name(self) -> str:
+        return (
+            f"{self.analyzers}-cache_{self.cache}-{self.commit_sampling}"
+            f"-{self.processes}p-{self.engine}"
+        )
+
+
+def _to_toml(value: Any) -> str:
+    # Just enough TOML for the configs below, JSON strings are valid TOML.
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return json.dumps(value)
+
+
+def _write_config(path: Path, config: dict[str, Any]) -> None:
+    lines = []
+    tables = []
+    for key, value in config.items():
+        if isinstance(value, dict):
+            tables.append((key, value))
+        else:
+            lines.append(f"{key} = {_to_toml(value)}")
+    while tables:
+        table_name, table = tables.pop(0)
+        table_lines = []
+        for key, value in table.items():
+            if isinstance(value, dict):
+                tables.append((f"{table_name}.{key}", value))
+            else:
+                table_lines.append(f"{key} = {_to_toml(value)}")
+        if table_lines:
+            lines += ["", f"[{table_name}]", *table_lines]
+    path.write_text("\n".join(lines) + "\n")
+
+
+def _get_size(path: Path) -> int:
+    if not path.exists():
+        return 0
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+def _run_main(config_path: Path) -> tuple[float, int]:
+    start_time = time.perf_counter()
+    process = subprocess.Popen([sys.executable, str(MAIN_PATH), str(config_path)])
+    # Unlike getrusage(), wait4() reports the peak RSS of this run alone (the
+    # largest of main.py and its workers).
+    _, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start_time
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+    # ru_maxrss is in KiB on Linux.
+    return seconds, rusage.ru_maxrss * 1024
+
+
+def run_case(case: Case, *, repository: Path, directory: Path) -> dict[str, Any]:
+    directory.mkdir(parents=True)
+    cache_directory = directory / "cache"
+    output_path = directory / "stats.json"
+    config = {
+        "repository": str(repository),
+        "output": str(output_path),
+        "processes": case.processes,
+        "commit_sampling": case.commit_sampling,
+        "engine": case.engine,
+        "logging": {"level": "WARNING"},
+        "analyzers": ANALYZERS[case.analyzers],
+    }
+    if case.cache != "off":
+        config["cache"] = {"directory": str(cache_directory)}
+    config_path = directory / "config.toml"
+    _write_config(config_path, config)
+
+    if case.cache == "warm":
+        _run_main(config_path)
+    seconds, peak_rss = _run_main(config_path)
+    commit_count = len(json.loads(output_path.read_text()))
+    return {
+        "case": case.name,
+        **asdict(case),
+        "commits": commit_count,
+        "seconds": round(seconds, 3),
+        "commits_per_second": round(commit_count / seconds, 2),
+        "peak_rss_bytes": peak_rss,
+        "cache_bytes": _get_size(cache_directory),
+    }
+
+
+def main(
+    *,
+    output: Path | None,
+    repository: Path | None,
+    parameters: RepositoryParameters,
+    analyzers: list[str],
+    cache_modes: list[str],
+    commit_samplings: list[str],
+    processes: list[int],
+    engines: list[str],
+) -> None:
+    if "scc" in analyzers and not shutil.which("scc"):
+        print("scc not found, skipping scc cases", file=sys.stderr)
+        analyzers = [analyzer for analyzer in analyzers if analyzer != "scc"]
+
+    # Comparable across runs as long as the repository is the same.
+    repository_info: dict[str, Any] = (
+        {"path": str(repository)} if repository else asdict(parameters)
+    )
+
+    with TemporaryDirectory(prefix="stats-benchmark-") as tmp_dir:
+        if not repository:
+            repository = Path(tmp_dir) / "repository"
+            print(f"Generating repository: {parameters}", file=sys.stderr)
+            generate_repository(repository, parameters)
+
+        results = []
+        for case in itertools.starmap(
+            Case,
+            itertools.product(
+                analyzers, cache_modes, commit_samplings, processes, engines
+            ),
+        ):
+            print(f"Running {case.name}", file=sys.stderr)
+            result = run_case(
+                case, repository=repository, directory=Path(tmp_dir) / case.name
+            )
+            print(
+                f"{result['commits_per_second']} commits/s, "
+                f"{result['peak_rss_bytes'] / 1024 / 1024:.1f} MiB peak RSS",
+                file=sys.stderr,
+            )
+            results.append(result)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": cpu_count(),
+        "repository": repository_info,
+        "results": results,
+    }
+    report_json = json.dumps(report, indent=2)
+    if output:
+        output.write_text(report_json + "\n")
+    else:
+        print(report_json)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark main.py on a synthetic repository")
+    parser.add_argument("-o", "--output", type=Path, help="Write JSON report here")
+    parser.add_argument(
+        "--repository", type=Path, help="Use an existing repository instead"
+    )
+    parser.add_argument("--commits", type=int, default=RepositoryParameters.commits)
+    parser.add_argument("--files", type=int, default=RepositoryParameters.files)
+    parser.add_argument("--file-size", type=int, default=RepositoryParameters.file_size)
+    parser.add_argument("--churn", type=float, default=RepositoryParameters.churn)
+    parser.add_argument("--seed", type=int, default=RepositoryParameters.seed)
+    parser.add_argument(
+        "--analyzers", nargs="+", choices=list(ANALYZERS), default=list(ANALYZERS)
+    )
+    parser.add_argument(
+        "--cache", nargs="+", choices=CACHE_MODES, default=list(CACHE_MODES)
+    )
+    parser.add_argument(
+        "--commit-sampling",
+        nargs="+",
+        choices=("all", "last", "daily", "weekly", "monthly"),
+        default=["all", "daily"],
+    )
+    parser.add_argument(
+        "--processes", nargs="+", type=int, default=sorted({1, cpu_count()})
+    )
+    parser.add_argument(
+        "--engine", nargs="+", choices=("worktree", "blobs"), default=["worktree"]
+    )
+    arguments = parser.parse_args()
+    main(
+        output=arguments.output,
+        repository=arguments.repository,
+        parameters=RepositoryParameters(
+            commits=arguments.commits,
+            files=arguments.files,
+            file_size=arguments.file_size,
+            churn=arguments.churn,
+            seed=arguments.seed,
+        ),
+        analyzers=arguments.analyzers,
+        cache_modes=arguments.cache,
+        commit_samplings=arguments.commit_sampling,
+        processes=arguments.processes,
+        engines=arguments.engine,
+    )
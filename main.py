@@ -1,24 +1,83 @@
 from __future__ import annotations
 
-import json
+import heapq
 import logging
+import math
 import sys
+from argparse import ArgumentParser
+from collections import Counter
+from contextlib import ExitStack
 from dataclasses import asdict
 from multiprocessing import Pool, Queue, Value
+from multiprocessing.pool import Pool as ProcessPool
 from multiprocessing.sharedctypes import Synchronized
+from multiprocessing.util import Finalize
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import Any
+from typing import Any, Callable, Collection, Iterator, cast
 
 from stats.analyzers import (
     AnalyzerFunction,
     AnalyzerResult,
+    FileAnalyzerFunction,
+    MetadataAnalyzerFunction,
+    apply_file_changes,
     get_configured_analyzer_functions,
+    get_configured_metadata_analyzer_functions,
+    get_file_analyzer_names,
+    merge_file_results,
+)
+from stats.cache import (
+    collect_garbage,
+    get_commit_namespaces,
+    load_from_cache,
+    save_to_cache,
+    update_cache_meta,
+)
+from stats.checkouts import create_checkouts
+from stats.config import (
+    CommitSampling,
+    Config,
+    Engine,
+    OrchestrationMode,
+    OutputFormat,
+    load_config,
 )
-from stats.cache import invalidate_cache_if_needed, load_from_cache, save_to_cache
-from stats.config import Config, load_config
 from stats.filters import filter_commits
-from stats.git import Commit, get_commits, git
+from stats.metrics import Metrics, MetricsSummary, collect, get_counters, measure
+from stats.output import (
+    Checkpoint,
+    RollupWriter,
+    get_rollup_path,
+    load_checkpoint,
+    open_output,
+    open_output_for_append,
+)
+from stats.pipeline import CHECKOUTS_PER_WORKER, run_pipeline
+from stats.sampling import sample_adaptively
+from stats.sharding import (
+    Shard,
+    WorkerConnection,
+    coordinate,
+    get_shard_path,
+    merge_shards,
+    parse_shard,
+    save_shard_manifest,
+)
+from stats.git import (
+    Commit,
+    CommitTree,
+    FileChanges,
+    GitCatFile,
+    TrackedFile,
+    Tree,
+    Worktree,
+    checkout,
+    get_commit_metadata,
+    get_commits,
+    get_file_changes,
+    get_tree_file_sizes,
+)
 
 logging.basicConfig(format="%(levelname)s: %(message)s")
 logger = logging.getLogger(__name__)
@@ -26,148 +85,864 @@ logger = logging.getLogger(__name__)
 
 def analyze_commit(
     *,
-    repository: Path,
-    cache: Config.Cache | None,
+    tree: Tree,
     commit: Commit,
     analyzer_name: str,
     analyzer_function: AnalyzerFunction,
-) -> AnalyzerResult:
+    pending_analyzer_names: Collection[str] | None = None,
+    previous_result: AnalyzerResult | None = None,
+    changes: FileChanges | None = None,
+    files: list[TrackedFile] | None = None,
+) -> AnalyzerResult | None:
+    # All analyzers that look at trees look at individual files.
+    file_analyzer_function = cast(FileAnalyzerFunction, analyzer_function)
     try:
-        if cache and (
-            cached_results := load_from_cache(
-                cache, commit_hash=commit.hash, analyzer_name=analyzer_name
-            )
-        ):
-            return cached_results
-        logger.debug(f"Running analyzer function for '{analyzer_name}' @ {commit.hash}")
-        result = analyzer_function(repository)
-        if cache:
-            save_to_cache(
-                cache,
-                commit_hash=commit.hash,
-                analyzer_name=analyzer_name,
-                data=result,
+        # Analyzers measure themselves, analyzers that share a pass over the
+        # files (see FusedScan) each only the time spent on their results.
+        with measure("scan", analyzer=analyzer_name):
+            if files is not None:
+                logger.debug(
+                    f"Running analyzer function for '{analyzer_name}' "
+                    f"@ {commit.hash} on {len(files)} files"
+                )
+                return file_analyzer_function(
+                    tree, files=files, analyzer_names=pending_analyzer_names
+                )
+            if previous_result is not None and changes is not None:
+                logger.debug(
+                    f"Running analyzer function for '{analyzer_name}' "
+                    f"@ {commit.hash} on {len(changes.changed)} changed files"
+                )
+                changed_result = file_analyzer_function(
+                    tree, files=changes.changed, analyzer_names=pending_analyzer_names
+                )
+                return apply_file_changes(previous_result, changes, changed_result)
+            logger.debug(
+                f"Running analyzer function for '{analyzer_name}' @ {commit.hash}"
             )
-        return result
+            return file_analyzer_function(tree, analyzer_names=pending_analyzer_names)
     except Exception as e:
         logger.error("Exception while running analyzer", exc_info=e)
-        return {}
+        return None
 
 
-def process_commit(commit: Commit) -> dict[str, Any]:
-    log_level: str = process_commit.log_level  # type: ignore[attr-defined]
-    tmp_repositories: Queue[Path] = process_commit.tmp_repositories  # type: ignore[attr-defined]
-    cache: Config.Cache = process_commit.cache  # type: ignore[attr-defined]
-    analyzer_functions = process_commit.analyzer_functions  # type: ignore[attr-defined]
-    processed_commit_count: Synchronized[int] = process_commit.processed_commit_count  # type: ignore[attr-defined]
-    total_commit_count: Synchronized[int] = process_commit.total_commit_count  # type: ignore[attr-defined]
+def analyze_commit_metadata(
+    repository: Path,
+    commits: list[Commit],
+    metadata_analyzer_functions: dict[str, MetadataAnalyzerFunction],
+) -> Iterator[dict[str, AnalyzerResult | None]]:
+    if not metadata_analyzer_functions:
+        for _ in commits:
+            yield {}
+        return
+    for commit in get_commit_metadata(repository, (commit.hash for commit in commits)):
+        results: dict[str, AnalyzerResult | None] = {}
+        for analyzer_name, analyzer_function in metadata_analyzer_functions.items():
+            logger.debug(
+                f"Running analyzer function for '{analyzer_name}' @ {commit.hash}"
+            )
+            try:
+                with measure(f"analyzer:{analyzer_name}"):
+                    results[analyzer_name] = analyzer_function(commit)
+            except Exception as e:
+                logger.error("Exception while running analyzer", exc_info=e)
+                results[analyzer_name] = None
+        yield results
 
-    logging.root.setLevel(level=log_level)
 
-    processed_commit_count.value += 1
-    current = processed_commit_count.value
+def get_unique_tree_commits(commits: list[Commit]) -> list[Commit]:
+    # The first commit of each tree, the others get its results.
+    seen_trees = set()
+    unique_tree_commits = []
+    for commit in commits:
+        if commit.tree not in seen_trees:
+            seen_trees.add(commit.tree)
+            unique_tree_commits.append(commit)
+    return unique_tree_commits
+
+
+def fan_out_results(
+    commits: list[Commit], results: Iterator[tuple[dict[str, Any], Metrics]]
+) -> Iterator[tuple[dict[str, Any], Metrics]]:
+    # Results come in for the commits of get_unique_tree_commits(), and are only
+    # kept around while later commits share their tree.
+    remaining_commits = Counter(commit.tree for commit in commits)
+    shared_results: dict[str, dict[str, Any]] = {}
+    for commit in commits:
+        remaining_commits[commit.tree] -= 1
+        if commit.tree in shared_results:
+            analyzer_results = (
+                shared_results[commit.tree]
+                if remaining_commits[commit.tree]
+                else shared_results.pop(commit.tree)
+            )
+            yield {
+                "commit": commit.hash,
+                "timestamp": commit.timestamp.timestamp(),
+                "analyzers": analyzer_results,
+            }, Metrics()
+            continue
+        result, metrics = next(results)
+        if remaining_commits[commit.tree]:
+            shared_results[commit.tree] = result["analyzers"]
+        yield result, metrics
+
+
+def partition_files(
+    files: list[tuple[TrackedFile, int]], count: int
+) -> list[list[TrackedFile]]:
+    # Largest files first, each into the batch with the fewest bytes so far.
+    batches: list[tuple[int, int, list[TrackedFile]]] = [
+        (0, index, []) for index in range(count)
+    ]
+    for file, size in sorted(files, key=lambda entry: entry[1], reverse=True):
+        total_size, index, batch = heapq.heappop(batches)
+        batch.append(file)
+        heapq.heappush(batches, (total_size + size, index, batch))
+    return [
+        sorted(batch, key=lambda file: file.path) for _, _, batch in batches if batch
+    ]
+
+
+def create_rollup_writer(
+    rollup_path: Path, checkpoint: Checkpoint | None
+) -> RollupWriter | None:
+    if not checkpoint:
+        return RollupWriter()
+    # Only continue a rollup that ends where the appended output does.
+    if (
+        rollup_path.exists()
+        and (rollup_writer := RollupWriter.load(rollup_path)).last_commit
+        == checkpoint.commit
+    ):
+        return rollup_writer
+    logger.warning(f"{rollup_path} doesn't match the output, not updating it")
+    return None
+
+
+def write_records(
+    records: Iterator[dict[str, Any]],
+    *,
+    config: Config,
+    checkpoint: Checkpoint | None,
+    shard: Shard | None,
+) -> None:
+    if shard:
+        # Partial output, combined with the other shards by --merge.
+        shard_path = get_shard_path(config.output, shard)
+        logger.info(f"Saving results to {shard_path} as they come in")
+        with open_output(shard_path, output_format=OutputFormat.NDJSON) as output:
+            for record in records:
+                with measure("serialize"):
+                    output.write(record)
+        return
+
+    logger.info(f"Saving results to {config.output} as they come in")
+    rollup_path = get_rollup_path(config.output)
+    rollup_writer = (
+        create_rollup_writer(rollup_path, checkpoint) if config.rollup else None
+    )
+    with (
+        open_output_for_append(
+            config.output,
+            output_format=config.output_format,
+            checkpoint=checkpoint,
+        )
+        if config.append
+        else open_output(config.output, output_format=config.output_format)
+    ) as output:
+        for record in records:
+            with measure("serialize"):
+                output.write(record)
+                if rollup_writer:
+                    rollup_writer.write(record)
+    if rollup_writer:
+        # Written after the output, so it's never older than the output it
+        # summarizes (see scripts/loaders.py).
+        logger.info(f"Saving per-commit totals to {rollup_path}")
+        rollup_writer.save(rollup_path)
+
+
+def get_selected_commits(config: Config) -> list[Commit]:
+    return list(
+        filter_commits(
+            get_commits(
+                config.repository,
+                revisions=config.commits.revisions,
+                since=config.commits.since,
+                until=config.commits.until,
+                first_parent=config.commits.first_parent,
+                # Only the latest commit is needed, no need to list the others.
+                max_count=(
+                    1
+                    if config.commit_sampling is CommitSampling.LAST
+                    else config.commits.max_count
+                ),
+            ),
+            commit_sampling=config.commit_sampling,
+            every=config.commits.every,
+        )
+    )
+
+
+def log_progress(
+    commit: Commit,
+    processed_commit_count: Synchronized[int],
+    total_commit_count: Synchronized[int],
+) -> None:
+    with processed_commit_count.get_lock():
+        processed_commit_count.value += 1
+        current = processed_commit_count.value
     total = total_commit_count.value
     logger.info(f"[{current}/{total}] Processing commit {commit.hash}")
 
-    repository = tmp_repositories.get()
-    git(repository, "checkout", commit.hash)
 
-    analyzer_results = {
-        analyzer_name: analyze_commit(
-            repository=repository,
-            cache=cache,
-            commit=commit,
-            analyzer_name=analyzer_name,
-            analyzer_function=analyzer_function,
+def analyze_uncached(
+    commit: Commit,
+    analyzer_names: list[str],
+    analyze: Callable[[list[str]], dict[str, AnalyzerResult | None]],
+    *,
+    cache: Config.Cache | None,
+    cache_namespaces: dict[str, str],
+) -> dict[str, AnalyzerResult | None]:
+    # Results of all analyzers for the commit's tree, only those that aren't
+    # cached yet are analyzed, and cached unless they failed.
+    cached_results = (
+        load_from_cache(cache, tree_hash=commit.tree, namespaces=cache_namespaces)
+        if cache
+        else {}
+    )
+    pending_analyzer_names = [
+        analyzer_name
+        for analyzer_name in analyzer_names
+        if analyzer_name not in cached_results
+    ]
+    results = analyze(pending_analyzer_names) if pending_analyzer_names else {}
+    if cache and results:
+        save_to_cache(
+            cache,
+            tree_hash=commit.tree,
+            namespaces=cache_namespaces,
+            results={
+                analyzer_name: result
+                for analyzer_name, result in results.items()
+                if result is not None
+            },
         )
-        for analyzer_name, analyzer_function in analyzer_functions.items()
+    return {
+        analyzer_name: (
+            cached_results[analyzer_name]
+            if analyzer_name in cached_results
+            else results[analyzer_name]
+        )
+        for analyzer_name in analyzer_names
     }
 
-    tmp_repositories.put_nowait(repository)
 
+def create_record(
+    commit: Commit, analyzer_results: dict[str, AnalyzerResult | None]
+) -> dict[str, Any]:
     return {
         "commit": commit.hash,
         "timestamp": commit.timestamp.timestamp(),
-        "analyzers": analyzer_results,
+        "analyzers": {
+            analyzer_name: result or {}
+            for analyzer_name, result in analyzer_results.items()
+        },
     }
 
 
+def process_commit(
+    commit: Commit, checked_out_repository: Path | None = None
+) -> tuple[dict[str, Any], Metrics]:
+    with measure("commit", commit=commit.hash) as args:
+        result = _process_commit(commit, checked_out_repository)
+        # Per-commit counters, e.g. cache hits and bytes read.
+        args |= get_counters()
+    return result, collect()
+
+
+def _process_commit(
+    commit: Commit, checked_out_repository: Path | None
+) -> dict[str, Any]:
+    log_level: str = process_commit.log_level  # type: ignore[attr-defined]
+    engine: Engine = process_commit.engine  # type: ignore[attr-defined]
+    source_repository: Path = process_commit.repository  # type: ignore[attr-defined]
+    tmp_repository: Path = process_commit.tmp_repository  # type: ignore[attr-defined]
+    cat_file: GitCatFile | None = process_commit.cat_file  # type: ignore[attr-defined]
+    cache: Config.Cache = process_commit.cache  # type: ignore[attr-defined]
+    cache_namespaces: dict[str, str] = process_commit.cache_namespaces  # type: ignore[attr-defined]
+    analyzer_functions = process_commit.analyzer_functions  # type: ignore[attr-defined]
+    incremental_analyzer_names: set[str] = process_commit.incremental_analyzer_names  # type: ignore[attr-defined]
+    previous_commit: Commit | None = process_commit.previous_commit  # type: ignore[attr-defined]
+    previous_results: dict[str, AnalyzerResult | None] = process_commit.previous_results  # type: ignore[attr-defined]
+    processed_commit_count: Synchronized[int] = process_commit.processed_commit_count  # type: ignore[attr-defined]
+    total_commit_count: Synchronized[int] = process_commit.total_commit_count  # type: ignore[attr-defined]
+    checkout_seconds: Synchronized[float] = process_commit.checkout_seconds  # type: ignore[attr-defined]
+    checkout_bytes: Synchronized[int] = process_commit.checkout_bytes  # type: ignore[attr-defined]
+
+    logging.root.setLevel(level=log_level)
+
+    log_progress(commit, processed_commit_count, total_commit_count)
+
+    tree: Tree
+    match engine:
+        case Engine.WORKTREE if checked_out_repository:
+            # Already checked out by the asyncio pipeline.
+            tree = Worktree(checked_out_repository)
+        case Engine.WORKTREE:
+            seconds, written_bytes = checkout(tmp_repository, commit.hash)
+            logger.debug(
+                f"Checked out {commit.hash} in {seconds:.3f}s, "
+                f"writing {written_bytes} bytes"
+            )
+            with checkout_seconds.get_lock():
+                checkout_seconds.value += seconds
+            with checkout_bytes.get_lock():
+                checkout_bytes.value += written_bytes
+            tree = Worktree(tmp_repository)
+        case Engine.BLOBS:
+            tree = CommitTree(
+                source_repository,
+                revision=commit.hash,
+                cat_file=cast(GitCatFile, cat_file),
+            )
+
+    # Per-file analyzers only need to look at files that changed since the
+    # previous commit this worker processed, the rest is carried forward.
+    changes = (
+        get_file_changes(tree.repository, previous_commit.hash, commit.hash)
+        if previous_commit and incremental_analyzer_names
+        else None
+    )
+
+    # Analyzers that share a pass over the files only need to compute results
+    # that weren't cached.
+    analyzer_results = analyze_uncached(
+        commit,
+        list(analyzer_functions),
+        lambda pending_analyzer_names: {
+            analyzer_name: analyze_commit(
+                tree=tree,
+                commit=commit,
+                analyzer_name=analyzer_name,
+                analyzer_function=analyzer_functions[analyzer_name],
+                pending_analyzer_names=pending_analyzer_names,
+                previous_result=(
+                    previous_results.get(analyzer_name)
+                    if analyzer_name in incremental_analyzer_names
+                    else None
+                ),
+                changes=changes,
+            )
+            for analyzer_name in pending_analyzer_names
+        },
+        cache=cache,
+        cache_namespaces=cache_namespaces,
+    )
+
+    process_commit.previous_commit = commit  # type: ignore[attr-defined]
+    process_commit.previous_results = analyzer_results  # type: ignore[attr-defined]
+
+    return create_record(commit, analyzer_results)
+
+
+def process_files(
+    commit: Commit, files: list[TrackedFile], analyzer_names: list[str]
+) -> tuple[dict[str, AnalyzerResult | None], Metrics]:
+    # One batch of the files of a commit that is split across all workers.
+    log_level: str = process_commit.log_level  # type: ignore[attr-defined]
+    source_repository: Path = process_commit.repository  # type: ignore[attr-defined]
+    cat_file: GitCatFile | None = process_commit.cat_file  # type: ignore[attr-defined]
+    analyzer_functions = process_commit.analyzer_functions  # type: ignore[attr-defined]
+
+    logging.root.setLevel(level=log_level)
+
+    with measure("files", commit=commit.hash, files=len(files)) as args:
+        tree = CommitTree(
+            source_repository, revision=commit.hash, cat_file=cast(GitCatFile, cat_file)
+        )
+        results = {
+            analyzer_name: analyze_commit(
+                tree=tree,
+                commit=commit,
+                analyzer_name=analyzer_name,
+                analyzer_function=analyzer_functions[analyzer_name],
+                pending_analyzer_names=analyzer_names,
+                files=files,
+            )
+            for analyzer_name in analyzer_names
+        }
+        args |= get_counters()
+    return results, collect()
+
+
+def analyze_commit_files(
+    pool: ProcessPool,
+    commit: Commit,
+    *,
+    repository: Path,
+    processes: int,
+    cache: Config.Cache | None,
+    cache_namespaces: dict[str, str],
+    analyzer_names: list[str],
+    processed_commit_count: Synchronized[int],
+    total_commit_count: Synchronized[int],
+) -> tuple[dict[str, Any], Metrics]:
+    # Splits the files of a commit into batches that all of the pool's workers
+    # analyze at the same time (see process_files()).
+    log_progress(commit, processed_commit_count, total_commit_count)
+    metrics = Metrics()
+
+    def analyze(
+        pending_analyzer_names: list[str],
+    ) -> dict[str, AnalyzerResult | None]:
+        files = list(get_tree_file_sizes(repository, commit.hash))
+        batches = partition_files(files, processes)
+        logger.info(f"Analyzing {len(files)} files in {len(batches)} batches")
+        batch_results = pool.starmap(
+            process_files,
+            [(commit, batch, pending_analyzer_names) for batch in batches],
+        )
+        for _, batch_metrics in batch_results:
+            metrics.events += batch_metrics.events
+            metrics.counters.update(batch_metrics.counters)
+        merged_results: dict[str, AnalyzerResult | None] = {}
+        for analyzer_name in pending_analyzer_names:
+            partial_results = [results[analyzer_name] for results, _ in batch_results]
+            # Like a full run, an error in any batch fails the whole analyzer.
+            merged_results[analyzer_name] = (
+                None
+                if None in partial_results
+                else merge_file_results(cast(list[AnalyzerResult], partial_results))
+            )
+        return merged_results
+
+    analyzer_results = analyze_uncached(
+        commit,
+        analyzer_names,
+        analyze,
+        cache=cache,
+        cache_namespaces=cache_namespaces,
+    )
+    return create_record(commit, analyzer_results), metrics
+
+
 def process_commit_init(
     log_level: str,
-    tmp_repositories: Queue[Path],
+    engine: Engine,
+    repository: Path,
+    tmp_repositories: Queue[Path] | None,
     cache: Config.Cache | None,
+    cache_namespaces: dict[str, str],
     analyzer_functions: dict[str, AnalyzerFunction],
+    incremental_analyzer_names: set[str],
     processed_commit_count: Synchronized[int],
     total_commit_count: Synchronized[int],
+    checkout_seconds: Synchronized[float],
+    checkout_bytes: Synchronized[int],
 ) -> None:
     # https://stackoverflow.com/a/3843313/5952681
+    # Forked workers start out with a copy of the main process' metrics.
+    collect()
     process_commit.log_level = log_level  # type: ignore[attr-defined]
-    process_commit.tmp_repositories = tmp_repositories  # type: ignore[attr-defined]
+    process_commit.engine = engine  # type: ignore[attr-defined]
+    process_commit.repository = repository  # type: ignore[attr-defined]
+    # Each worker keeps using the same clone, so that checking out the next
+    # commit of its chunk only needs to update a few files.
+    process_commit.tmp_repository = (  # type: ignore[attr-defined]
+        tmp_repositories.get()
+        if engine is Engine.WORKTREE and tmp_repositories
+        else None
+    )
+    # One long-lived process per worker to read blobs, see Engine.BLOBS.
+    process_commit.cat_file = (  # type: ignore[attr-defined]
+        GitCatFile(repository) if engine is Engine.BLOBS else None
+    )
+    if process_commit.cat_file:  # type: ignore[attr-defined]
+        # Workers exit without running atexit handlers, but do run finalizers
+        # with a priority.
+        Finalize(
+            process_commit.cat_file,  # type: ignore[attr-defined]
+            process_commit.cat_file.close,  # type: ignore[attr-defined]
+            exitpriority=0,
+        )
     process_commit.cache = cache  # type: ignore[attr-defined]
+    process_commit.cache_namespaces = cache_namespaces  # type: ignore[attr-defined]
     process_commit.analyzer_functions = analyzer_functions  # type: ignore[attr-defined]
+    process_commit.incremental_analyzer_names = incremental_analyzer_names  # type: ignore[attr-defined]
+    process_commit.previous_commit = None  # type: ignore[attr-defined]
+    process_commit.previous_results = {}  # type: ignore[attr-defined]
     process_commit.processed_commit_count = processed_commit_count  # type: ignore[attr-defined]
     process_commit.total_commit_count = total_commit_count  # type: ignore[attr-defined]
+    process_commit.checkout_seconds = checkout_seconds  # type: ignore[attr-defined]
+    process_commit.checkout_bytes = checkout_bytes  # type: ignore[attr-defined]
 
 
-def main(*, config_path: Path) -> None:
+def main(
+    *,
+    config_path: Path,
+    garbage_collection: bool,
+    shard: Shard | None,
+    merge: bool,
+    coordinator: bool,
+    worker: bool,
+) -> None:
     config = load_config(config_path)
     logging.root.setLevel(level=config.logging.level)
 
     logger.debug("Config: %s", asdict(config))
 
-    logger.info("Creating temporary directories for repository checkouts")
-    tmp_dirs = [TemporaryDirectory(prefix="stats-") for _ in range(config.processes)]
+    if garbage_collection:
+        if not config.cache:
+            logger.error("No cache configured")
+            sys.exit(1)
+        logger.info(f"Collecting garbage in {config.cache.directory}")
+        collect_garbage(config.cache)
+        return
 
-    total = len(tmp_dirs)
-    tmp_repositories: Queue[Path] = Queue(maxsize=total)
-    for current, tmp_dir in enumerate(tmp_dirs, start=1):
-        tmp_repository = Path(tmp_dir.name) / config.repository.name
-        tmp_repositories.put_nowait(tmp_repository)
-        logger.info(f"[{current}/{total}] Cloning repository to {tmp_repository}")
-        # Clone provided repo to /tmp to:
-        # - avoid untracked files when checking out earlier commits
-        # - speed up the checkout process
-        git(config.repository, "clone", ".", str(tmp_repository))
+    if merge:
+        try:
+            merge_shards(
+                config.output,
+                output_format=config.output_format,
+                rollup=config.rollup,
+            )
+        except ValueError as e:
+            logger.error(f"Can't merge shards: {e}")
+            sys.exit(1)
+        return
 
-    logger.info("Creating analyzer functions from config")
-    analyzer_functions = get_configured_analyzer_functions(config.analyzers)
+    if (shard or coordinator or worker) and (
+        config.append or config.commit_sampling is CommitSampling.ADAPTIVE
+    ):
+        logger.error(
+            "Shards, coordinators and workers don't support appending or "
+            "adaptive sampling"
+        )
+        sys.exit(1)
 
-    logger.info("Getting commits to analyze")
-    commits = list(
-        filter_commits(
-            get_commits(tmp_repository), commit_sampling=config.commit_sampling
+    checkpoint = None
+    if config.append:
+        if (
+            config.output_format is OutputFormat.NPY
+            or config.commit_sampling is CommitSampling.ADAPTIVE
+        ):
+            logger.error(
+                "Appending only works with json or ndjson output, "
+                "and without adaptive sampling"
+            )
+            sys.exit(1)
+        checkpoint = load_checkpoint(config.output, output_format=config.output_format)
+
+    # Workers get their commits from the coordinator.
+    commits: list[Commit] = []
+    if not worker:
+        logger.info("Getting commits to analyze")
+        commits = get_selected_commits(config)
+
+    if shard:
+        commits = shard.select(commits)
+        logger.info(f"Analyzing {len(commits)} commits of shard {shard.index}")
+        save_shard_manifest(config.output, shard, commits)
+
+    if checkpoint:
+        commit_hashes = [commit.hash for commit in commits]
+        if checkpoint.commit not in commit_hashes:
+            logger.error(
+                f"Last analyzed commit {checkpoint.commit} isn't selected anymore, "
+                "run without append to start over"
+            )
+            sys.exit(1)
+        commits = commits[commit_hashes.index(checkpoint.commit) + 1 :]
+        logger.info(f"Appending {len(commits)} commits after {checkpoint.commit}")
+
+    if coordinator:
+        # Commits are analyzed by workers, this only hands them out and writes
+        # their results.
+        batch_size = config.coordinator.batch_size
+        write_records(
+            coordinate(
+                [
+                    commits[start : start + batch_size]
+                    for start in range(0, len(commits), batch_size)
+                ],
+                address=config.coordinator.address,
+                authkey=config.coordinator.authkey,
+                batch_timeout=config.coordinator.batch_timeout,
+            ),
+            config=config,
+            checkpoint=None,
+            shard=None,
         )
+        return
+
+    logger.info("Creating analyzer functions from config")
+    analyzer_functions = get_configured_analyzer_functions(
+        config.analyzers, cache=config.cache
+    )
+    metadata_analyzer_functions = get_configured_metadata_analyzer_functions(
+        config.analyzers
+    )
+
+    # Without any analyzers that look at files, there's nothing to check out.
+    engine = config.engine if analyzer_functions else Engine.BLOBS
+
+    # With fewer commits than processes, the files of each commit are split
+    # across all workers instead, which read them from the object database.
+    split_files = (
+        not worker
+        and config.commit_sampling is not CommitSampling.ADAPTIVE
+        and len(get_unique_tree_commits(commits)) < config.processes
+    )
+    if split_files:
+        engine = Engine.BLOBS
+
+    pipelined = config.orchestration.mode is OrchestrationMode.ASYNCIO
+
+    # The blobs engine reads files straight from the object database of the
+    # provided repo, and doesn't need any checkouts.
+    checkout_count = (
+        config.processes * (CHECKOUTS_PER_WORKER if pipelined else 1)
+        if engine is Engine.WORKTREE
+        else 0
+    )
+
+    if config.checkouts.directory:
+        tmp_dir = None
+        checkouts_directory = config.checkouts.directory
+    else:
+        logger.info("Creating temporary directory for repository checkouts")
+        tmp_dir = TemporaryDirectory(prefix="stats-")
+        checkouts_directory = Path(tmp_dir.name)
+
+    logger.info(f"Setting up {checkout_count} checkouts in {checkouts_directory}")
+    metrics_summary = MetricsSummary(keep_events=config.metrics.trace is not None)
+
+    checkouts = create_checkouts(
+        config.repository,
+        checkouts_directory,
+        count=checkout_count,
+        setup=config.checkouts.setup,
     )
+    # With the asyncio pipeline, checkouts are managed by the main process.
+    tmp_repositories: Queue[Path] | None = None
+    if not pipelined:
+        tmp_repositories = Queue(maxsize=checkout_count)
+        for tmp_repository in checkouts:
+            tmp_repositories.put_nowait(tmp_repository)
 
-    logger.info("Invalidating cache")
-    invalidate_cache_if_needed(config)
+    logger.info("Updating cache metadata")
+    update_cache_meta(config)
+
+    cache_namespaces = get_commit_namespaces(
+        {
+            analyzer_name: config.analyzers[analyzer_name]
+            for analyzer_name in analyzer_functions
+        }
+    )
+    processed_commit_count = Value("i", 0)
+    total_commit_count = Value("i", 0)
+    checkout_seconds = Value("d", 0.0)
+    checkout_bytes = Value("q", 0)
+
+    initargs = (
+        config.logging.level,
+        engine,
+        config.repository,
+        tmp_repositories,
+        config.cache,
+        cache_namespaces,
+        analyzer_functions,
+        get_file_analyzer_names(config.analyzers) if config.incremental else set(),
+        processed_commit_count,
+        total_commit_count,
+        checkout_seconds,
+        checkout_bytes,
+    )
 
     try:
-        with Pool(
-            processes=config.processes,
-            initializer=process_commit_init,
-            initargs=(
-                config.logging.level,
-                tmp_repositories,
-                config.cache,
-                analyzer_functions,
-                Value("i", 0),
-                Value("i", len(commits)),
-            ),
-        ) as pool:
-            results = list(pool.map(process_commit, commits))
+        with ExitStack() as stack:
+            pool = (
+                None
+                if pipelined and not split_files
+                else stack.enter_context(
+                    Pool(
+                        processes=config.processes,
+                        initializer=process_commit_init,
+                        initargs=initargs,
+                    )
+                )
+            )
+
+            def analyze_commits(commits: list[Commit]) -> Iterator[dict[str, Any]]:
+                unique_tree_commits = get_unique_tree_commits(commits)
+                if len(unique_tree_commits) < len(commits):
+                    logger.info(
+                        f"Analyzing {len(unique_tree_commits)} unique trees "
+                        f"of {len(commits)} commits"
+                    )
+                with total_commit_count.get_lock():
+                    total_commit_count.value += len(unique_tree_commits)
+                # Hand out contiguous chunks of commits, which each worker
+                # processes in order, so that consecutive checkouts (and diffs)
+                # are small steps.
+                chunk_size = max(
+                    config.chunk_size
+                    or math.ceil(len(unique_tree_commits) / (config.processes * 4)),
+                    1,
+                )
+                results: Iterator[tuple[dict[str, Any], Metrics]]
+                if split_files and pool:
+                    results = (
+                        analyze_commit_files(
+                            pool,
+                            commit,
+                            repository=config.repository,
+                            processes=config.processes,
+                            cache=config.cache,
+                            cache_namespaces=cache_namespaces,
+                            analyzer_names=list(analyzer_functions),
+                            processed_commit_count=processed_commit_count,
+                            total_commit_count=total_commit_count,
+                        )
+                        for commit in unique_tree_commits
+                    )
+                elif pool:
+                    results = pool.imap(
+                        process_commit, unique_tree_commits, chunksize=chunk_size
+                    )
+                else:
+                    # Check out the next commit while the current one is analyzed.
+                    results = run_pipeline(
+                        unique_tree_commits,
+                        process_commit=process_commit,
+                        checkouts=checkouts,
+                        processes=config.processes,
+                        chunk_size=chunk_size,
+                        max_git_processes=config.orchestration.max_git_processes,
+                        initializer=process_commit_init,
+                        initargs=initargs,
+                        checkout_seconds=checkout_seconds,
+                        checkout_bytes=checkout_bytes,
+                    )
+                # Both come in the order of commits.
+                for (result, metrics), metadata_results in zip(
+                    fan_out_results(commits, results),
+                    analyze_commit_metadata(
+                        config.repository, commits, metadata_analyzer_functions
+                    ),
+                    strict=True,
+                ):
+                    analyzer_results = result["analyzers"] | {
+                        analyzer_name: analyzer_result or {}
+                        for analyzer_name, analyzer_result in metadata_results.items()
+                    }
+                    # Keep analyzers in the order of the config.
+                    result["analyzers"] = {
+                        analyzer_name: analyzer_results[analyzer_name]
+                        for analyzer_name in config.analyzers
+                    }
+                    metrics_summary.add(metrics)
+                    yield result
+
+            if worker:
+                connection = WorkerConnection(
+                    address=config.coordinator.address,
+                    authkey=config.coordinator.authkey,
+                )
+                for index, batch in connection.get_batches():
+                    logger.info(f"Analyzing batch {index + 1} ({len(batch)} commits)")
+                    connection.submit(index, list(analyze_commits(batch)))
+            else:
+                write_records(
+                    (
+                        sample_adaptively(
+                            commits,
+                            analyze_commits,
+                            adaptive_sampling=config.adaptive_sampling,
+                            file_analyzer_names=get_file_analyzer_names(
+                                config.analyzers
+                            ),
+                        )
+                        if config.commit_sampling is CommitSampling.ADAPTIVE
+                        else analyze_commits(commits)
+                    ),
+                    config=config,
+                    checkpoint=checkpoint,
+                    shard=shard,
+                )
+
+            if pool:
+                # Let workers exit on their own rather than being terminated
+                # when leaving the context, so that their finalizers run.
+                pool.close()
+                pool.join()
 
-        logger.info(f"Saving results to {config.output}, this might take a while!")
-        config.output.parent.mkdir(parents=True, exist_ok=True)
-        config.output.write_text(json.dumps(results))
+        if engine is Engine.WORKTREE:
+            logger.info(
+                f"Spent {checkout_seconds.value:.1f}s on checkouts, "
+                f"writing {checkout_bytes.value / 1024 / 1024:.1f} MiB"
+            )
+
+        # Everything that happened in the main process.
+        metrics_summary.add(collect())
+        metrics_summary.log()
+        if config.metrics.trace:
+            logger.info(f"Writing trace to {config.metrics.trace}")
+            metrics_summary.write_trace(config.metrics.trace)
     except KeyboardInterrupt:
-        logger.info("Aborted")
+        logger.info(
+            "Aborted, results so far have been saved and will be appended to"
+            if config.append
+            else "Aborted"
+        )
     finally:
-        for current, tmp_dir in enumerate(tmp_dirs, start=1):
-            logger.info(f"[{current}/{total}] Cleaning up {tmp_dir.name}")
+        if tmp_dir:
+            logger.info(f"Cleaning up {tmp_dir.name}")
             tmp_dir.cleanup()
 
 
 if __name__ == "__main__":
-    config_path = Path(sys.argv[1] if len(sys.argv) > 1 else "config.toml")
-    main(config_path=config_path)
+    parser = ArgumentParser()
+    parser.add_argument("config_path", type=Path, nargs="?", default="config.toml")
+    parser.add_argument(
+        "--collect-garbage",
+        action="store_true",
+        default=False,
+        help="Remove unused and least recently used cache entries, then exit",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        metavar="i/N",
+        help="Only analyze the i-th (starting at 0) of N ranges of commits, "
+        "into a partial output next to the configured one",
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        default=False,
+        help="Combine the outputs of all shards into the configured output, then exit",
+    )
+    parser.add_argument(
+        "--coordinator",
+        action="store_true",
+        default=False,
+        help="Hand out batches of commits to workers and write their results",
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        default=False,
+        help="Analyze batches of commits from a coordinator",
+    )
+    arguments = parser.parse_args()
+    main(
+        config_path=arguments.config_path,
+        garbage_collection=arguments.collect_garbage,
+        shard=arguments.shard,
+        merge=arguments.merge,
+        coordinator=arguments.coordinator,
+        worker=arguments.worker,
+    )
@@ -2,37 +2,132 @@ from __future__ import annotations
 
 import csv
 import datetime
-import json
+import struct
 import sys
+from argparse import ArgumentParser
 from collections import defaultdict
+from multiprocessing import Process, Queue
 from pathlib import Path
+from typing import IO, Any, Iterator
 
+from loaders import load_stats
 
-def main(*, stats_path: Path) -> None:
-    stats = json.loads(stats_path.read_text())
-    processed = defaultdict(list)
-    for commit in stats:
-        for analyzer_name, analyzer_results in commit["analyzers"].items():
+
+# Commits per message to a writer process, and messages queued per writer, which
+# bounds memory use when writers fall behind.
+BATCH_SIZE = 100
+QUEUE_SIZE = 8
+
+# https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\0" + struct.pack("!ii", 0, 0)
+PGCOPY_TRAILER = struct.pack("!h", -1)
+# Postgres timestamps are microseconds since 2000-01-01.
+PG_EPOCH = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC).timestamp()
+
+Batch = list[tuple[str, float, dict[str, Any]]]
+
+
+def get_rows(batches: Queue[Batch | None]) -> Iterator[list[Any]]:
+    while (batch := batches.get()) is not None:
+        for commit_hash, timestamp, analyzer_results in batch:
             for file, result in analyzer_results.items():
-                row = [
-                    commit["commit"],
-                    datetime.datetime.fromtimestamp(
-                        commit["timestamp"], datetime.UTC
-                    ).strftime("%Y-%m-%d %H:%M:%S"),
+                yield [
+                    commit_hash,
+                    timestamp,
                     file,
                     *(result.values() if isinstance(result, dict) else [result]),
                 ]
-                processed[analyzer_name].append(row)
 
-    for analyzer_name, rows in processed.items():
-        with stats_path.parent.joinpath(f"{analyzer_name}.csv").open("w") as f:
-            writer = csv.writer(f, delimiter=",")
-            writer.writerows(rows)
 
+def write_csv(f: IO[str], rows: Iterator[list[Any]]) -> None:
+    writer = csv.writer(f, delimiter=",")
+    for row in rows:
+        row[1] = datetime.datetime.fromtimestamp(row[1], datetime.UTC).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        )
+        writer.writerow(row)
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print(f"usage: {sys.argv[0]} <stats_path>")
+
+def encode_pgcopy_field(value: Any) -> bytes:
+    match value:
+        case None:
+            return struct.pack("!i", -1)
+        case bool():
+            data = struct.pack("!?", value)
+        case int():
+            data = struct.pack("!q", value)
+        case float():
+            data = struct.pack("!d", value)
+        case _:
+            data = str(value).encode()
+    return struct.pack("!i", len(data)) + data
+
+
+def write_pgcopy(f: IO[bytes], rows: Iterator[list[Any]]) -> None:
+    # Columns are text, timestamp(tz), text, and then bigint, double precision,
+    # boolean or text depending on the analyzer's fields.
+    f.write(PGCOPY_HEADER)
+    for commit_hash, timestamp, *values in rows:
+        f.write(struct.pack("!h", len(values) + 2))
+        f.write(encode_pgcopy_field(commit_hash))
+        f.write(struct.pack("!iq", 8, round((timestamp - PG_EPOCH) * 1_000_000)))
+        f.writelines(map(encode_pgcopy_field, values))
+    f.write(PGCOPY_TRAILER)
+
+
+def write_analyzer(path: Path, binary: bool, batches: Queue[Batch | None]) -> None:
+    if binary:
+        with path.open("wb") as binary_file:
+            write_pgcopy(binary_file, get_rows(batches))
+    else:
+        with path.open("w") as text_file:
+            write_csv(text_file, get_rows(batches))
+
+
+def main(*, stats_path: Path, binary: bool) -> None:
+    # Records are read one at a time and each analyzer's rows are written by a
+    # separate process, so reading, formatting and writing happen in parallel.
+    writers: dict[str, tuple[Process, Queue[Batch | None]]] = {}
+    batches: defaultdict[str, Batch] = defaultdict(list)
+    try:
+        for commit in load_stats(stats_path):
+            for analyzer_name, analyzer_results in commit["analyzers"].items():
+                if analyzer_name not in writers:
+                    queue: Queue[Batch | None] = Queue(maxsize=QUEUE_SIZE)
+                    extension = "pgcopy" if binary else "csv"
+                    process = Process(
+                        target=write_analyzer,
+                        args=(
+                            stats_path.parent / f"{analyzer_name}.{extension}",
+                            binary,
+                            queue,
+                        ),
+                    )
+                    process.start()
+                    writers[analyzer_name] = (process, queue)
+                batch = batches[analyzer_name]
+                batch.append((commit["commit"], commit["timestamp"], analyzer_results))
+                if len(batch) == BATCH_SIZE:
+                    writers[analyzer_name][1].put(batches.pop(analyzer_name))
+        for analyzer_name, batch in batches.items():
+            writers[analyzer_name][1].put(batch)
+    finally:
+        for process, queue in writers.values():
+            queue.put(None)
+        for process, _ in writers.values():
+            process.join()
+    if any(process.exitcode for process, _ in writers.values()):
         sys.exit(1)
-    stats_path = Path(sys.argv[1])
-    main(stats_path=stats_path)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("stats_path", type=Path)
+    parser.add_argument(
+        "--binary",
+        action="store_true",
+        default=False,
+        help="Write PostgreSQL binary COPY files (<analyzer>.pgcopy) instead of CSV",
+    )
+    arguments = parser.parse_args()
+    main(stats_path=arguments.stats_path, binary=arguments.binary)
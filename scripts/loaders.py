@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Iterator
+
+JSON_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class AnalyzerColumns:
+    offsets: Any
+    paths: Any
+    scalar: bool
+    kinds: dict[str, str]
+    fields: dict[str, Any]
+
+    def totals(self, name: str = "value") -> Any:
+        # Sum of a field per commit, commit i spans offsets[i]:offsets[i + 1].
+        import numpy as np  # type: ignore[import]
+
+        sums = np.concatenate(([0], np.cumsum(self.fields[name])))
+        return sums[self.offsets[1:]] - sums[self.offsets[:-1]]
+
+
+@dataclass
+class Columns:
+    commits: Any
+    timestamps: Any
+    strings: list[str]
+    analyzers: dict[str, AnalyzerColumns]
+
+
+def load_columns(stats_path: Path) -> Columns:
+    # Columnar output (output_format = "npy"), all arrays are memory-mapped.
+    import numpy as np  # type: ignore[import]
+
+    def load(path: Path) -> Any:
+        return np.load(path, mmap_mode="r")
+
+    schema = json.loads((stats_path / "schema.json").read_text())
+    string_data = load(stats_path / "strings.npy")
+    string_offsets = load(stats_path / "string_offsets.npy")
+    strings = [
+        bytes(string_data[start:end]).decode()
+        for start, end in zip(string_offsets[:-1], string_offsets[1:])
+    ]
+    return Columns(
+        commits=load(stats_path / "commits.npy"),
+        timestamps=load(stats_path / "timestamps.npy"),
+        strings=strings,
+        analyzers={
+            analyzer_name: AnalyzerColumns(
+                offsets=load(analyzer_path / "offsets.npy"),
+                paths=load(analyzer_path / "paths.npy"),
+                scalar=analyzer_schema["scalar"],
+                kinds=analyzer_schema["fields"],
+                fields={
+                    name: load(analyzer_path / f"{name}.npy")
+                    for name in analyzer_schema["fields"]
+                },
+            )
+            for analyzer_name, analyzer_schema in schema["analyzers"].items()
+            if (analyzer_path := stats_path / "analyzers" / analyzer_name)
+        },
+    )
+
+
+@dataclass
+class Rollup:
+    commits: Any
+    timestamps: Any
+    analyzers: list[str]
+    _arrays: Any
+
+    def totals(self, analyzer: str, name: str = "value") -> Any:
+        # Sum of a field per commit, fields that never occurred are all zero.
+        import numpy as np  # type: ignore[import]
+
+        key = f"{analyzer}/{name}"
+        if key not in self._arrays:
+            return np.zeros(len(self.timestamps), dtype=np.int64)
+        return self._arrays[key]
+
+
+def load_rollup(stats_path: Path) -> Rollup | None:
+    # Per-commit totals written next to the output with rollup = true. Ignored
+    # when the output has been written again since, e.g. with rollup disabled.
+    rollup_path = stats_path.with_name(f"{stats_path.stem}.rollup.npz")
+    if (
+        not rollup_path.exists()
+        or rollup_path.stat().st_mtime < stats_path.stat().st_mtime
+    ):
+        return None
+    import numpy as np  # type: ignore[import]
+
+    arrays = np.load(rollup_path)
+    return Rollup(
+        commits=arrays["commits"],
+        timestamps=arrays["timestamps"],
+        analyzers=arrays["analyzers"].tolist(),
+        _arrays=arrays,
+    )
+
+
+def _load_column_records(stats_path: Path) -> Iterator[dict[str, Any]]:
+    columns = load_columns(stats_path)
+    strings = columns.strings
+    for index, commit in enumerate(columns.commits):
+        analyzers = {}
+        for analyzer_name, analyzer in columns.analyzers.items():
+            result = {}
+            for row in range(analyzer.offsets[index], analyzer.offsets[index + 1]):
+                values = {
+                    name: (
+                        strings[column[row]]
+                        if analyzer.kinds[name] == "string"
+                        else column[row].item()
+                    )
+                    for name, column in analyzer.fields.items()
+                }
+                path = strings[analyzer.paths[row]]
+                result[path] = values["value"] if analyzer.scalar else values
+            analyzers[analyzer_name] = result
+        yield {
+            "commit": str(commit),
+            "timestamp": columns.timestamps[index].item(),
+            "analyzers": analyzers,
+        }
+
+
+def _load_json_records(stats_path: Path) -> Iterator[dict[str, Any]]:
+    # Decodes the JSON array one record at a time, so that the whole file never
+    # needs to be in memory.
+    decoder = json.JSONDecoder()
+    chunk_size = JSON_CHUNK_SIZE
+    with stats_path.open() as f:
+        buffer = ""
+        position = 0
+        end_of_file = False
+        while True:
+            # Skip the array's brackets and commas between records.
+            while position < len(buffer) and buffer[position] in "[, \t\r\n":
+                position += 1
+            if buffer[position : position + 1] == "]":
+                return
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if end_of_file:
+                    raise
+                chunk = f.read(chunk_size)
+                end_of_file = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                # Read more at once for records larger than a chunk, instead of
+                # decoding their beginning over and over.
+                chunk_size *= 2
+                continue
+            chunk_size = JSON_CHUNK_SIZE
+            yield record
+
+
+def load_stats(stats_path: Path) -> Iterator[dict[str, Any]]:
+    if stats_path.is_dir():
+        yield from _load_column_records(stats_path)
+    # NDJSON output contains one commit per line and can be read lazily.
+    elif stats_path.suffix in (".ndjson", ".jsonl"):
+        with stats_path.open() as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        yield from _load_json_records(stats_path)
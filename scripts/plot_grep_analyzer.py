@@ -2,20 +2,41 @@ from __future__ import annotations
 
 from argparse import ArgumentParser
 import datetime
-import json
 import sys
 from pathlib import Path
 
 import matplotlib.pyplot as plt  # type: ignore[import]
 
+from loaders import load_columns, load_rollup, load_stats
 
-def main(*, stats_path: Path, analyzer: str, cumulative: bool) -> None:
-    stats = json.loads(stats_path.read_text())
+
+def sum_commits(
+    *, stats_path: Path, analyzer: str, cumulative: bool
+) -> tuple[list[datetime.datetime], list[int]]:
+    if (rollup := load_rollup(stats_path)) and analyzer in rollup.analyzers:
+        # Already summed up per commit.
+        timestamps = rollup.timestamps
+        totals = rollup.totals(analyzer)
+    elif stats_path.is_dir():
+        # Columnar output, sum up memory-mapped columns without any parsing.
+        columns = load_columns(stats_path)
+        timestamps = columns.timestamps
+        totals = columns.analyzers[analyzer].totals()
+    else:
+        totals = None
+    if totals is not None:
+        return (
+            [
+                datetime.datetime.fromtimestamp(timestamp, datetime.UTC)
+                for timestamp in timestamps.tolist()
+            ],
+            (totals.cumsum() if cumulative else totals).tolist(),
+        )
 
     x = []
     y = []
     cumulative_sum = 0
-    for commit in stats:
+    for commit in load_stats(stats_path):
         timestamp = datetime.datetime.fromtimestamp(commit["timestamp"], datetime.UTC)
         total_count = sum(commit["analyzers"][analyzer].values())
         x.append(timestamp)
@@ -24,6 +45,11 @@ def main(*, stats_path: Path, analyzer: str, cumulative: bool) -> None:
             y.append(cumulative_sum)
         else:
             y.append(total_count)
+    return x, y
+
+
+def main(*, stats_path: Path, analyzer: str, cumulative: bool) -> None:
+    x, y = sum_commits(stats_path=stats_path, analyzer=analyzer, cumulative=cumulative)
 
     plt.step(x, y)
     plt.title(f"Occurrences of {analyzer} over time, sourced from {stats_path.stem}")
@@ -1,13 +1,14 @@
 from __future__ import annotations
 
 import datetime
-import json
 import sys
 from dataclasses import dataclass
 from pathlib import Path
 
 import matplotlib.pyplot as plt  # type: ignore[import]
 
+from loaders import load_columns, load_rollup, load_stats
+
 
 @dataclass
 class SCCResults:
@@ -28,12 +29,38 @@ class SCCResults:
         return (self.lines, self.code, self.comment, self.blank)
 
 
-def main(*, stats_path: Path, analyzer: str) -> None:
-    stats = json.loads(stats_path.read_text())
+def sum_commits(
+    *, stats_path: Path, analyzer: str
+) -> tuple[list[datetime.datetime], list[tuple[int, int, int, int]]]:
+    if (rollup := load_rollup(stats_path)) and analyzer in rollup.analyzers:
+        # Already summed up per commit.
+        timestamps = rollup.timestamps
+        totals = [
+            rollup.totals(analyzer, name)
+            for name in ("lines", "code", "comment", "blank")
+        ]
+    elif stats_path.is_dir():
+        # Columnar output, sum up memory-mapped columns without any parsing.
+        columns = load_columns(stats_path)
+        timestamps = columns.timestamps
+        totals = [
+            columns.analyzers[analyzer].totals(name)
+            for name in ("lines", "code", "comment", "blank")
+        ]
+    else:
+        totals = []
+    if totals:
+        return (
+            [
+                datetime.datetime.fromtimestamp(timestamp, datetime.UTC)
+                for timestamp in timestamps.tolist()
+            ],
+            list(zip(*(total.tolist() for total in totals))),
+        )
 
     x = []
     y = []
-    for commit in stats:
+    for commit in load_stats(stats_path):
         timestamp = datetime.datetime.fromtimestamp(commit["timestamp"], datetime.UTC)
         lines = sum(
             (
@@ -49,6 +76,11 @@ def main(*, stats_path: Path, analyzer: str) -> None:
         ).as_tuple()
         x.append(timestamp)
         y.append(lines)
+    return x, y
+
+
+def main(*, stats_path: Path, analyzer: str) -> None:
+    x, y = sum_commits(stats_path=stats_path, analyzer=analyzer)
 
     for statistic, name in zip(zip(*y), ("Lines", "Code", "Comments", "Blank")):
         plt.step(x, statistic, label=name)
@@ -1,43 +1,175 @@
 from __future__ import annotations
 
 from functools import partial
-from pathlib import Path
-from typing import cast, Any, Callable, TypeAlias
+from typing import Any, Callable, Collection, Iterable, Protocol, TypeAlias
 
 from stats.analyzers import (
     grep as grep_analyzer,
     grep_commits as grep_commits_analyzer,
+    loc as loc_analyzer,
     scc as scc_analyzer,
 )
+from stats.analyzers.scan import FileScanner, run_scanners
+from stats.cache import get_blob_cache
 from stats.config import AnalyzerConfig, Config
-from stats.git import Commit
+from stats.git import CommitMetadata, FileChanges, TrackedFile, Tree
 
 
 AnalyzerResult: TypeAlias = dict[str, Any]
-AnalyzerFunction: TypeAlias = Callable[[Path], AnalyzerResult]
+AnalyzerFunction: TypeAlias = Callable[[Tree], AnalyzerResult]
+# Analyzers that only look at commit metadata (message, author etc.) and not at
+# any files. They run in the main process on the output of a single git log.
+MetadataAnalyzerFunction: TypeAlias = Callable[[CommitMetadata], AnalyzerResult]
+
+
+class FileAnalyzerFunction(Protocol):
+    # analyzer_names are all analyzers whose results are still needed for the
+    # tree, which analyzers sharing a pass over the files (see FusedScan) use
+    # to skip the others.
+    def __call__(
+        self,
+        tree: Tree,
+        *,
+        files: Iterable[TrackedFile] | None = None,
+        analyzer_names: Collection[str] | None = None,
+    ) -> AnalyzerResult: ...
+
+
+FILE_ANALYZER_TYPES = (
+    Config.Analyzers.Grep,
+    Config.Analyzers.SCC,
+    Config.Analyzers.LOC,
+)
+METADATA_ANALYZER_TYPES = (Config.Analyzers.GrepCommits,)
+
+
+def get_file_analyzer_names(analyzers: dict[str, AnalyzerConfig]) -> set[str]:
+    return {
+        analyzer_name
+        for analyzer_name, analyzer in analyzers.items()
+        if isinstance(analyzer, FILE_ANALYZER_TYPES)
+    }
+
+
+def apply_file_changes(
+    previous_result: AnalyzerResult,
+    changes: FileChanges,
+    changed_result: AnalyzerResult,
+) -> AnalyzerResult:
+    # Changed files may have been filtered out this time (e.g. by the glob), so
+    # drop all of their previous results, not just those of removed files.
+    stale_paths = changes.removed | {file.path for file in changes.changed}
+    result = {
+        path: value
+        for path, value in previous_result.items()
+        if path not in stale_paths
+    }
+    result |= changed_result
+    # Keep the same order as a full run, which lists files sorted by path.
+    return dict(sorted(result.items()))
+
+
+def merge_file_results(partial_results: Iterable[AnalyzerResult]) -> AnalyzerResult:
+    # Results for disjoint batches of a tree's files, in the order of a full run.
+    result: AnalyzerResult = {}
+    for partial_result in partial_results:
+        result |= partial_result
+    return dict(sorted(result.items()))
+
+
+class FusedScan:
+    # Runs all grep and loc analyzers in a single pass over a tree, reading each
+    # file once. Whichever analyzer is called first for a tree computes the
+    # results of all of them that are still needed (e.g. not cached yet), the
+    # others pick theirs up afterwards.
+    def __init__(self, scanners: dict[str, FileScanner]) -> None:
+        self._scanners = scanners
+        self._tree: Tree | None = None
+        self._files: Iterable[TrackedFile] | None = None
+        self._results: dict[str, AnalyzerResult] = {}
+
+    def run(
+        self,
+        tree: Tree,
+        *,
+        analyzer_name: str,
+        files: Iterable[TrackedFile] | None = None,
+        analyzer_names: Collection[str] | None = None,
+    ) -> AnalyzerResult:
+        if (
+            tree is not self._tree
+            or files is not self._files
+            or analyzer_name not in self._results
+        ):
+            self._results = run_scanners(
+                tree,
+                scanners={
+                    name: scanner
+                    for name, scanner in self._scanners.items()
+                    if name == analyzer_name
+                    or analyzer_names is None
+                    or name in analyzer_names
+                },
+                files=files,
+            )
+            self._tree = tree
+            self._files = files
+        return self._results.pop(analyzer_name)
 
 
 def get_configured_analyzer_functions(
     analyzers: dict[str, AnalyzerConfig],
+    *,
+    cache: Config.Cache | None,
 ) -> dict[str, AnalyzerFunction]:
+    scanners: dict[str, FileScanner] = {}
+    for analyzer_name, analyzer in analyzers.items():
+        blob_cache = get_blob_cache(cache, analyzer) if cache else None
+        if isinstance(analyzer, Config.Analyzers.Grep):
+            scanners[analyzer_name] = grep_analyzer.compile_pattern(
+                files_glob=analyzer.files_glob,
+                regex=analyzer.regex,
+                case_insensitive=analyzer.case_insensitive,
+                binary_files=analyzer.binary_files,
+                max_file_size=analyzer.max_file_size,
+                blob_cache=blob_cache,
+            )
+        elif isinstance(analyzer, Config.Analyzers.LOC):
+            scanners[analyzer_name] = loc_analyzer.LineCounter(
+                files_glob=analyzer.files_glob, blob_cache=blob_cache
+            )
+    fused_scan = FusedScan(scanners)
     return {
         analyzer_name: {
             Config.Analyzers.Grep: lambda: partial(
-                grep_analyzer.run,
-                regex=cast(Config.Analyzers.Grep, analyzer).regex,
-                case_insensitive=cast(Config.Analyzers.Grep, analyzer).case_insensitive,
+                fused_scan.run, analyzer_name=analyzer_name
+            ),
+            Config.Analyzers.LOC: lambda: partial(
+                fused_scan.run, analyzer_name=analyzer_name
+            ),
+            Config.Analyzers.SCC: lambda: partial(
+                scc_analyzer.run,
+                analyzer_name=analyzer_name,
                 files_glob=analyzer.files_glob,
+                blob_cache=get_blob_cache(cache, analyzer) if cache else None,
             ),
+        }[type(analyzer)]()
+        for analyzer_name, analyzer in analyzers.items()
+        if not isinstance(analyzer, METADATA_ANALYZER_TYPES)
+    }
+
+
+def get_configured_metadata_analyzer_functions(
+    analyzers: dict[str, AnalyzerConfig],
+) -> dict[str, MetadataAnalyzerFunction]:
+    return {
+        analyzer_name: {
             Config.Analyzers.GrepCommits: lambda: partial(
                 grep_commits_analyzer.run,
-                regex=cast(Config.Analyzers.GrepCommits, analyzer).regex,
-                case_insensitive=cast(
-                    Config.Analyzers.GrepCommits, analyzer
-                ).case_insensitive,
-            ),
-            Config.Analyzers.SCC: lambda: partial(
-                scc_analyzer.run, files_glob=analyzer.files_glob
+                regex=analyzer.regex,
+                case_insensitive=analyzer.case_insensitive,
             ),
         }[type(analyzer)]()
         for analyzer_name, analyzer in analyzers.items()
+        if isinstance(analyzer, METADATA_ANALYZER_TYPES)
     }
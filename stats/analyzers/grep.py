@@ -1,27 +1,176 @@
 from __future__ import annotations
 
 import re
-from pathlib import Path
-from typing import TYPE_CHECKING
+from dataclasses import dataclass, field
+from typing import Any, Callable
 
+from stats.cache import BlobCache
 from stats.filters import filter_files
-from stats.git import get_files
+from stats.git import FileContent, TrackedFile, Tree
 
-if TYPE_CHECKING:
-    from stats.analyzers import AnalyzerResult
+# Like git, files with a NUL byte in their first 8000 bytes are binary.
+BINARY_SNIFF_SIZE = 8000
 
 
-def run(
-    repository: Path, *, files_glob: str | None, regex: str, case_insensitive: bool
-) -> AnalyzerResult:
-    pattern = re.compile(
-        regex.encode(),
-        re.IGNORECASE if case_insensitive else re.NOFLAG,
+# Characters with a special meaning in regexes, unless escaped.
+SPECIAL_CHARACTERS = frozenset(b".^$*+?{}[]()")
+# Escaped letters that stand for a single character, like in Python strings.
+ESCAPED_CHARACTERS = {
+    b"a": b"\a",
+    b"f": b"\f",
+    b"n": b"\n",
+    b"r": b"\r",
+    b"t": b"\t",
+    b"v": b"\v",
+}
+
+
+def is_binary(content: FileContent) -> bool:
+    return content.find(b"\0", 0, BINARY_SNIFF_SIZE) != -1
+
+
+def parse_literals(regex: bytes) -> list[bytes] | None:
+    # The alternatives of regexes like "fixme|todo" or "TODO\(", or None if an
+    # actual regex engine is needed.
+    literals = [b""]
+    for token in re.findall(rb"\\x[0-9a-fA-F]{2}|\\.|.", regex, re.DOTALL):
+        if token == b"|":
+            literals.append(b"")
+        elif token[0] == ord("\\"):
+            escaped = token[1:]
+            if escaped in ESCAPED_CHARACTERS:
+                literals[-1] += ESCAPED_CHARACTERS[escaped]
+            elif escaped[0] == ord("x") and len(escaped) == 3:
+                literals[-1] += bytes.fromhex(escaped[1:].decode())
+            # Other escaped letters and digits are character classes, anchors etc.
+            elif escaped.isalnum():
+                return None
+            else:
+                literals[-1] += escaped
+        elif token[0] in SPECIAL_CHARACTERS:
+            return None
+        else:
+            literals[-1] += token
+    if not all(literals):
+        return None
+    return list(dict.fromkeys(literals))
+
+
+def _can_overlap(first: bytes, second: bytes) -> bool:
+    # Whether a match of second can start within a match of first.
+    return second in first or any(
+        first.endswith(second[:length]) for length in range(1, len(second))
+    )
+
+
+def get_counted_literals(regex: str, *, case_insensitive: bool) -> list[bytes] | None:
+    # Literals that can be counted separately with bytes.count(), with the same
+    # result as counting matches of the whole regex. That's only the case if no
+    # two of them can overlap, otherwise it depends on which one comes first.
+    literals = parse_literals(regex.encode())
+    # re is faster than bytes.count() for a single literal (escaped or not), but
+    # not for alternations or when ignoring case.
+    if literals is None or (len(literals) == 1 and not case_insensitive):
+        return None
+    if case_insensitive:
+        # Like re.IGNORECASE for bytes patterns, this only folds ASCII letters.
+        literals = list(dict.fromkeys(literal.lower() for literal in literals))
+    if any(
+        _can_overlap(first, second)
+        for first in literals
+        for second in literals
+        if first != second
+    ):
+        return None
+    return literals
+
+
+class _LowercaseContent:
+    # Case-insensitive patterns of all analyzers share one lowercase copy of the
+    # file that's currently being scanned.
+    def __init__(self) -> None:
+        self._content: bytes | None = None
+        self._lowercase_content = b""
+
+    def get(self, content: bytes) -> bytes:
+        if content is not self._content:
+            self._content = content
+            self._lowercase_content = content.lower()
+        return self._lowercase_content
+
+
+_lowercase_content = _LowercaseContent()
+
+
+@dataclass
+class Pattern:
+    pattern: re.Pattern[bytes]
+    files_glob: str | None
+    # Counted with bytes.count() instead of the regex, see get_counted_literals().
+    literals: list[bytes] | None = None
+    case_insensitive: bool = False
+    binary_files: bool = False
+    max_file_size: int | None = None
+    blob_cache: BlobCache | None = None
+    # Looked up once rather than for every file, most files are small enough
+    # for this to add up.
+    _findall: Callable[[bytes], list[Any]] = field(init=False, repr=False)
+    _checks_content: bool = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._findall = self.pattern.findall
+        self._checks_content = self.max_file_size is not None or not self.binary_files
+
+    def select(self, tree: Tree, files: list[TrackedFile]) -> list[TrackedFile]:
+        if not self.files_glob:
+            return files
+        return list(
+            filter_files(
+                files,
+                glob_pattern=self.files_glob,
+                key=lambda file: tree.repository / file.path,
+            )
+        )
+
+    def get_cache_key(self, file: TrackedFile) -> str:
+        return file.blob_hash
+
+    def scan(self, file: TrackedFile, content: FileContent) -> int | None:
+        # Skipped files are left out of the results.
+        if self._checks_content and (
+            (self.max_file_size is not None and len(content) > self.max_file_size)
+            or (not self.binary_files and is_binary(content))
+        ):
+            return None
+        if type(content) is bytes:
+            if self.literals is None:
+                return len(self._findall(content))
+            if self.case_insensitive:
+                content = _lowercase_content.get(content)
+            return sum(content.count(literal) for literal in self.literals)
+        # Neither a list of all matches of a memory-mapped file nor a copy for
+        # bytes.count(), which could be as large as the file.
+        return sum(1 for _ in self.pattern.finditer(content))
+
+
+def compile_pattern(
+    *,
+    files_glob: str | None,
+    regex: str,
+    case_insensitive: bool,
+    binary_files: bool = False,
+    max_file_size: int | None = None,
+    blob_cache: BlobCache | None = None,
+) -> Pattern:
+    return Pattern(
+        pattern=re.compile(
+            regex.encode(),
+            re.IGNORECASE if case_insensitive else re.NOFLAG,
+        ),
+        files_glob=files_glob,
+        literals=get_counted_literals(regex, case_insensitive=case_insensitive),
+        case_insensitive=case_insensitive,
+        binary_files=binary_files,
+        max_file_size=max_file_size,
+        blob_cache=blob_cache,
     )
-    files = get_files(repository)
-    if files_glob:
-        files = filter_files(files, glob_pattern=files_glob)
-    return {
-        str(path.relative_to(repository)): len(pattern.findall(path.read_bytes()))
-        for path in files
-    }
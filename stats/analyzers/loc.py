@@ -0,0 +1,309 @@
+from __future__ import annotations
+
+import hashlib
+import re
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import Any
+
+from stats.cache import BlobCache
+from stats.filters import filter_files
+from stats.git import FileContent, TrackedFile, Tree
+
+
+@dataclass
+class Language:
+    name: str
+    extensions: tuple[str, ...] = ()
+    filenames: tuple[str, ...] = ()
+    line_comments: tuple[bytes, ...] = ()
+    block_comments: tuple[tuple[bytes, bytes], ...] = ()
+    complexity_keywords: tuple[bytes, ...] = ()
+    complexity_pattern: re.Pattern[bytes] | None = field(init=False, repr=False)
+    comment_pattern: re.Pattern[bytes] | None = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        # Like scanning line by line, the earliest marker wins. Block comments win
+        # over line comments starting at the same position, whose marker may be
+        # a prefix of theirs (e.g. "--[[" and "--" in Lua). Unterminated block
+        # comments run until the end of the file.
+        self.comment_pattern = (
+            re.compile(
+                b"|".join(
+                    [
+                        re.escape(start) + rb".*?(?:" + re.escape(end) + rb"|\Z)"
+                        for start, end in self.block_comments
+                    ]
+                    + [re.escape(marker) + rb"[^\n]*" for marker in self.line_comments]
+                ),
+                re.DOTALL,
+            )
+            if self.line_comments or self.block_comments
+            else None
+        )
+        # Whole words in a single group, which is much faster than one
+        # alternative per word. Words and operators never match at the same
+        # position, so their order doesn't matter.
+        words = [keyword for keyword in self.complexity_keywords if keyword.isalpha()]
+        self.complexity_pattern = (
+            re.compile(
+                b"|".join(
+                    (
+                        [rb"\b(?:" + b"|".join(map(re.escape, words)) + rb")\b"]
+                        if words
+                        else []
+                    )
+                    + [
+                        re.escape(keyword)
+                        for keyword in self.complexity_keywords
+                        if not keyword.isalpha()
+                    ]
+                )
+            )
+            if self.complexity_keywords
+            else None
+        )
+
+
+C_COMMENTS: dict[str, Any] = {
+    "line_comments": (b"//",),
+    "block_comments": ((b"/*", b"*/"),),
+}
+C_COMPLEXITY = (b"if", b"for", b"while", b"case", b"catch", b"&&", b"||", b"?")
+HASH_COMMENTS: dict[str, Any] = {"line_comments": (b"#",)}
+
+# Names follow scc, so that results of both analyzers can be compared.
+LANGUAGES = [
+    Language("C", extensions=(".c",), complexity_keywords=C_COMPLEXITY, **C_COMMENTS),
+    Language(
+        "C Header", extensions=(".h",), complexity_keywords=C_COMPLEXITY, **C_COMMENTS
+    ),
+    Language(
+        "C++",
+        extensions=(".cpp", ".cc", ".cxx", ".c++"),
+        complexity_keywords=C_COMPLEXITY,
+        **C_COMMENTS,
+    ),
+    Language(
+        "C++ Header",
+        extensions=(".hpp", ".hh", ".hxx"),
+        complexity_keywords=C_COMPLEXITY,
+        **C_COMMENTS,
+    ),
+    Language("C#", extensions=(".cs",), complexity_keywords=C_COMPLEXITY, **C_COMMENTS),
+    Language(
+        "Objective C",
+        extensions=(".m",),
+        complexity_keywords=C_COMPLEXITY,
+        **C_COMMENTS,
+    ),
+    Language(
+        "Objective C++",
+        extensions=(".mm",),
+        complexity_keywords=C_COMPLEXITY,
+        **C_COMMENTS,
+    ),
+    Language(
+        "Java", extensions=(".java",), complexity_keywords=C_COMPLEXITY, **C_COMMENTS
+    ),
+    Language(
+        "Kotlin",
+        extensions=(".kt", ".kts"),
+        complexity_keywords=(*C_COMPLEXITY, b"when"),
+        **C_COMMENTS,
+    ),
+    Language(
+        "Swift", extensions=(".swift",), complexity_keywords=C_COMPLEXITY, **C_COMMENTS
+    ),
+    Language(
+        "Go",
+        extensions=(".go",),
+        complexity_keywords=(b"if", b"for", b"case", b"select", b"&&", b"||"),
+        **C_COMMENTS,
+    ),
+    Language(
+        "Rust",
+        extensions=(".rs",),
+        complexity_keywords=(b"if", b"for", b"while", b"loop", b"match", b"&&", b"||"),
+        **C_COMMENTS,
+    ),
+    Language(
+        "JavaScript",
+        extensions=(".js", ".mjs", ".cjs"),
+        complexity_keywords=C_COMPLEXITY,
+        **C_COMMENTS,
+    ),
+    Language(
+        "TypeScript",
+        extensions=(".ts", ".mts", ".cts"),
+        complexity_keywords=C_COMPLEXITY,
+        **C_COMMENTS,
+    ),
+    Language("CSS", extensions=(".css",), block_comments=((b"/*", b"*/"),)),
+    Language(
+        "HTML",
+        extensions=(".html", ".htm"),
+        block_comments=((b"<!--", b"-->"),),
+    ),
+    Language(
+        "XML",
+        extensions=(".xml", ".svg"),
+        block_comments=((b"<!--", b"-->"),),
+    ),
+    Language(
+        "Python",
+        extensions=(".py", ".pyi"),
+        complexity_keywords=(
+            b"if",
+            b"elif",
+            b"for",
+            b"while",
+            b"except",
+            b"with",
+            b"and",
+            b"or",
+        ),
+        **HASH_COMMENTS,
+    ),
+    Language(
+        "Ruby",
+        extensions=(".rb",),
+        filenames=("Gemfile", "Rakefile"),
+        complexity_keywords=(b"if", b"elsif", b"unless", b"while", b"until", b"when"),
+        line_comments=(b"#",),
+        block_comments=((b"=begin", b"=end"),),
+    ),
+    Language(
+        "Shell",
+        extensions=(".sh", ".bash"),
+        complexity_keywords=(b"if", b"elif", b"for", b"while", b"case", b"&&", b"||"),
+        **HASH_COMMENTS,
+    ),
+    Language("Perl", extensions=(".pl", ".pm"), **HASH_COMMENTS),
+    Language(
+        "Lua",
+        extensions=(".lua",),
+        complexity_keywords=(b"if", b"elseif", b"for", b"while", b"and", b"or"),
+        line_comments=(b"--",),
+        block_comments=((b"--[[", b"]]"),),
+    ),
+    Language(
+        "SQL",
+        extensions=(".sql",),
+        line_comments=(b"--",),
+        block_comments=((b"/*", b"*/"),),
+    ),
+    Language("Assembly", extensions=(".s", ".S", ".asm"), line_comments=(b";",)),
+    Language("YAML", extensions=(".yaml", ".yml"), **HASH_COMMENTS),
+    Language("TOML", extensions=(".toml",), **HASH_COMMENTS),
+    Language("INI", extensions=(".ini", ".cfg"), line_comments=(b";", b"#")),
+    Language(
+        "Makefile",
+        extensions=(".mk",),
+        filenames=("Makefile", "makefile", "GNUmakefile"),
+        **HASH_COMMENTS,
+    ),
+    Language(
+        "CMake",
+        extensions=(".cmake",),
+        filenames=("CMakeLists.txt",),
+        **HASH_COMMENTS,
+    ),
+    Language("Dockerfile", filenames=("Dockerfile",), **HASH_COMMENTS),
+    Language("JSON", extensions=(".json",)),
+    Language("Markdown", extensions=(".md", ".markdown")),
+    Language("ReStructuredText", extensions=(".rst",)),
+    Language("Plain Text", extensions=(".txt", ".text")),
+]
+
+LANGUAGES_BY_FILENAME = {
+    filename: language for language in LANGUAGES for filename in language.filenames
+}
+LANGUAGES_BY_EXTENSION = {
+    extension: language for language in LANGUAGES for extension in language.extensions
+}
+
+# Lines that only consist of whitespace.
+BLANK_LINE_PATTERN = re.compile(rb"^[ \t\r\f\v]*$", re.MULTILINE)
+
+
+def get_language(path: str) -> Language | None:
+    path_ = PurePosixPath(path)
+    return LANGUAGES_BY_FILENAME.get(path_.name) or LANGUAGES_BY_EXTENSION.get(
+        path_.suffix
+    )
+
+
+# Replaces everything but newlines with spaces.
+COMMENT_TRANSLATION = bytes(
+    byte if byte == ord("\n") else ord(" ") for byte in range(256)
+)
+
+
+def _remove_comments(language: Language, body: bytes) -> bytes:
+    # Comments become whitespace, so that positions and lines stay the same.
+    if not language.comment_pattern:
+        return body
+    return language.comment_pattern.sub(
+        lambda match: match.group().translate(COMMENT_TRANSLATION), body
+    )
+
+
+def count_lines(language: Language, content: bytes) -> dict[str, Any]:
+    if not content:
+        line_count = 0
+    else:
+        line_count = content.count(b"\n") + (not content.endswith(b"\n"))
+    # Without the final newline, the empty string after it isn't a blank line.
+    body = content[:-1] if content.endswith(b"\n") else content
+    blank = len(BLANK_LINE_PATTERN.findall(body)) if content else 0
+
+    # Lines with anything but whitespace left once comments are removed contain
+    # code, all other non-blank lines only comments.
+    code_body = _remove_comments(language, body)
+    code = line_count - len(BLANK_LINE_PATTERN.findall(code_body)) if content else 0
+    # Like scc, keywords in comments don't count.
+    complexity = (
+        sum(1 for _ in language.complexity_pattern.finditer(code_body))
+        if language.complexity_pattern
+        else 0
+    )
+    return {
+        "language": language.name,
+        "bytes": len(content),
+        "lines": line_count,
+        "code": code,
+        "comment": line_count - blank - code,
+        "blank": blank,
+        "complexity": complexity,
+    }
+
+
+@dataclass
+class LineCounter:
+    files_glob: str | None
+    blob_cache: BlobCache | None = None
+
+    def select(self, tree: Tree, files: list[TrackedFile]) -> list[TrackedFile]:
+        if self.files_glob:
+            files = list(
+                filter_files(
+                    files,
+                    glob_pattern=self.files_glob,
+                    key=lambda file: Path(file.path),
+                )
+            )
+        # Files of unknown languages are skipped, like scc does.
+        return [file for file in files if get_language(file.path)]
+
+    def get_cache_key(self, file: TrackedFile) -> str:
+        # The language depends on the file name, identical blobs checked in
+        # under different names may therefore have different results.
+        name = PurePosixPath(file.path).name
+        return hashlib.sha1(f"{file.blob_hash} {name}".encode()).hexdigest()
+
+    def scan(self, file: TrackedFile, content: FileContent) -> dict[str, Any] | None:
+        if not (language := get_language(file.path)):
+            return None
+        # Memory-mapped files are read after all, lines are counted in bulk.
+        return count_lines(language, content[:])
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+from contextlib import ExitStack
+from typing import TYPE_CHECKING, Any, Iterable, Protocol
+
+from stats.cache import BlobCache, load_blobs_from_cache, save_blobs_to_cache
+from stats.git import FileContent, TrackedFile, Tree
+from stats.metrics import count, measure
+
+if TYPE_CHECKING:
+    from stats.analyzers import AnalyzerResult
+
+
+# Per-file analyzer that works on the contents of each file, several of them
+# can share a single pass over a tree.
+class FileScanner(Protocol):
+    blob_cache: BlobCache | None
+
+    def select(self, tree: Tree, files: list[TrackedFile]) -> list[TrackedFile]: ...
+
+    def get_cache_key(self, file: TrackedFile) -> str: ...
+
+    # Returns None for files without a result, which are left out.
+    def scan(self, file: TrackedFile, content: FileContent) -> Any: ...
+
+
+def run_scanners(
+    tree: Tree,
+    *,
+    scanners: dict[str, FileScanner],
+    files: Iterable[TrackedFile] | None = None,
+) -> dict[str, AnalyzerResult]:
+    if files is None:
+        files = tree.list_files()
+    files = list(files)
+
+    selected_files: dict[str, list[TrackedFile]] = {}
+    results: dict[str, dict[str, Any]] = {}
+    pending_scanners: dict[TrackedFile, list[str]] = {}
+    for name, scanner in scanners.items():
+        selected_files[name] = scanner.select(tree, files)
+        results[name] = (
+            load_blobs_from_cache(
+                scanner.blob_cache,
+                {scanner.get_cache_key(file) for file in selected_files[name]},
+            )
+            if scanner.blob_cache
+            else {}
+        )
+        for file in selected_files[name]:
+            if scanner.get_cache_key(file) not in results[name]:
+                pending_scanners.setdefault(file, []).append(name)
+
+    # Read every file only once, no matter how many scanners look at it. Each
+    # scanner's time is measured separately, as they share a single pass.
+    new_results: dict[str, dict[str, Any]] = {name: {} for name in scanners}
+    for file, names in pending_scanners.items():
+        with ExitStack() as stack:
+            with measure("read"):
+                content = stack.enter_context(tree.open(file))
+            count("bytes_read", len(content))
+            for name in names:
+                scanner = scanners[name]
+                with measure(f"analyzer:{name}"):
+                    new_results[name][scanner.get_cache_key(file)] = scanner.scan(
+                        file, content
+                    )
+
+    for name, scanner in scanners.items():
+        # Also remember files without results so they're not scanned again.
+        if scanner.blob_cache and new_results[name]:
+            save_blobs_to_cache(scanner.blob_cache, new_results[name])
+        results[name] |= new_results[name]
+
+    return {
+        name: {
+            file.path: result
+            for file in selected_files[name]
+            if (result := results[name][scanner.get_cache_key(file)]) is not None
+        }
+        for name, scanner in scanners.items()
+    }
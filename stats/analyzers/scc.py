@@ -1,58 +1,77 @@
 from __future__ import annotations
 
+import hashlib
 import json
 import subprocess
-from pathlib import Path
-from typing import TYPE_CHECKING, Any, cast
+from pathlib import Path, PurePosixPath
+from typing import TYPE_CHECKING, Any, Collection, Iterable, cast
 
+from stats.cache import BlobCache, run_with_blob_cache
 from stats.filters import filter_files
+from stats.git import TrackedFile, Tree
+from stats.metrics import measure
 
 if TYPE_CHECKING:
     from stats.analyzers import AnalyzerResult
 
 
-def run(repository: Path, *, files_glob: str | None) -> AnalyzerResult:
+# Keep the command line well below ARG_MAX when passing individual files.
+MAX_FILES_PER_RUN = 1000
+
+
+def _get_cache_key(file: TrackedFile) -> str:
+    # scc detects the language from the file name, identical blobs checked in
+    # under different names may therefore have different results.
+    name = PurePosixPath(file.path).name
+    return hashlib.sha1(f"{file.blob_hash} {name}".encode()).hexdigest()
+
+
+def _run_scc(*paths: Path) -> list[dict[str, Any]]:
     output = subprocess.check_output(
         [
             "scc",
             "--by-file",
             "--format",
             "json",
-            str(repository),
+            *map(str, paths),
         ],
         encoding="utf-8",
     )
     scc_results = cast(list[dict[str, Any]], json.loads(output))
 
     # Flatten into list of file results
-    per_file_results: list[dict[str, Any]] = [
+    return [
         file_results
         for language_results in scc_results
         for file_results in language_results["Files"]
     ]
 
-    # Adjust paths
-    for file_results in per_file_results:
-        file_results["Location"] = Path(file_results["Location"]).relative_to(
-            repository
-        )
 
-    # Filter results
-    if files_glob:
-        per_file_results = list(
-            filter_files(
-                per_file_results,
-                glob_pattern=files_glob,
-                key=lambda file_results: file_results["Location"],
+def _count_lines(
+    directory: Path, files: list[TrackedFile], *, whole_directory: bool
+) -> dict[str, dict[str, Any]]:
+    if whole_directory:
+        per_file_results = _run_scc(directory)
+    else:
+        per_file_results = [
+            file_results
+            for start in range(0, len(files), MAX_FILES_PER_RUN)
+            for file_results in _run_scc(
+                *(
+                    directory / file.path
+                    for file in files[start : start + MAX_FILES_PER_RUN]
+                )
             )
-        )
+        ]
 
-    # Sort results by path
-    per_file_results.sort(key=lambda file_results: file_results["Location"])
+    results_by_path = {
+        Path(file_results["Location"]).relative_to(directory).as_posix(): file_results
+        for file_results in per_file_results
+    }
 
-    # Map relevant values to each path
+    # Map relevant values to each path, files are already sorted by path.
     return {
-        str(file_results["Location"]): {
+        file.path: {
             "language": file_results["Language"],
             "bytes": file_results["Bytes"],
             "lines": file_results["Lines"],
@@ -61,5 +80,41 @@ def run(repository: Path, *, files_glob: str | None) -> AnalyzerResult:
             "blank": file_results["Blank"],
             "complexity": file_results["Complexity"],
         }
-        for file_results in per_file_results
+        for file in files
+        if (file_results := results_by_path.get(file.path))
     }
+
+
+def run(
+    tree: Tree,
+    *,
+    analyzer_name: str,
+    files_glob: str | None,
+    blob_cache: BlobCache | None = None,
+    files: Iterable[TrackedFile] | None = None,
+    # scc always runs on its own, see FileAnalyzerFunction.
+    analyzer_names: Collection[str] | None = None,
+) -> AnalyzerResult:
+    all_files = files is None
+    if files is None:
+        files = tree.list_files()
+    if files_glob:
+        files = filter_files(
+            files,
+            glob_pattern=files_glob,
+            key=lambda file: Path(file.path),
+        )
+    files = list(files)
+
+    def count_lines(uncached_files: list[TrackedFile]) -> dict[str, dict[str, Any]]:
+        # Running scc on the whole repository once is a lot cheaper than passing
+        # every file individually, which is what a cold cache would need.
+        with tree.materialize(uncached_files) as directory:
+            return _count_lines(
+                directory,
+                uncached_files,
+                whole_directory=all_files and len(uncached_files) == len(files),
+            )
+
+    with measure(f"analyzer:{analyzer_name}"):
+        return run_with_blob_cache(blob_cache, files, count_lines, key=_get_cache_key)
@@ -1,71 +1,513 @@
 from __future__ import annotations
 
+import hashlib
 import json
 import logging
-from dataclasses import asdict
+import os
+import shutil
+import sqlite3
+import time
+import zlib
+from dataclasses import asdict, dataclass
 from pathlib import Path
-from typing import cast
+from typing import Any, Callable, Iterable, Iterator, Protocol, cast
 
-from stats.config import Config
+from stats.config import AnalyzerConfig, CacheBackendType, CacheCompression, Config
+from stats.git import TrackedFile
+from stats.metrics import count, measure
 
 
 logger = logging.getLogger(__name__)
 
+# SQLite limits the number of parameters per statement.
+SQLITE_BATCH_SIZE = 500
 
-def invalidate_cache_if_needed(config: Config) -> None:
-    if not config.cache:
-        logger.debug("No cache configured, skipping invalidation")
-        return
-    if (cache_meta_path := config.cache.directory / "meta.json").exists():
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Access times are only updated when they're older than this, so that repeated
+# runs don't turn every cache hit into a write.
+ACCESS_TIME_RESOLUTION = 24 * 60 * 60
+
+
+# Per-commit results are stored by tree hash (see load_from_cache()), the names
+# below predate that.
+class CacheBackend(Protocol):
+    def load_commit(
+        self, commit_hash: str, namespaces: Iterable[str]
+    ) -> dict[str, Any]: ...
+
+    def save_commit(self, commit_hash: str, results: dict[str, Any]) -> None: ...
+
+    def load_blobs(self, namespace: str, keys: Iterable[str]) -> dict[str, Any]: ...
+
+    def save_blobs(self, namespace: str, results: dict[str, Any]) -> None: ...
+
+    def get_namespaces(self) -> set[str]: ...
+
+    def remove_namespace(self, namespace: str) -> None: ...
+
+    def evict(self, max_size: int) -> int: ...
+
+
+class DirectoryCache:
+    # One JSON file per commit and analyzer, and per blob. The modification
+    # time of each file doubles as its last access time.
+    def __init__(self, directory: Path) -> None:
+        self._directory = directory
+
+    def _get_commit_file(self, namespace: str, commit_hash: str) -> Path:
+        return (
+            self._directory
+            / "commits"
+            / namespace
+            / commit_hash[0]
+            / f"{commit_hash}.json"
+        )
+
+    def _get_blob_file(self, namespace: str, key: str) -> Path:
+        return self._directory / "blobs" / namespace / key[:2] / f"{key}.json"
+
+    def _read(self, cache_file: Path) -> Any:
+        modified = cache_file.stat().st_mtime
+        if (now := time.time()) - modified > ACCESS_TIME_RESOLUTION:
+            os.utime(cache_file, (now, now))
+        return json.loads(cache_file.read_text())
+
+    def _write(self, cache_file: Path, data: Any) -> None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        # Workers regularly come across the same blob at the same time, write
+        # to a temporary file first so nobody reads a half-written result.
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps(data))
+        tmp_file.replace(cache_file)
+
+    def _load(self, cache_files: dict[str, Path]) -> dict[str, Any]:
+        return {
+            key: self._read(cache_file)
+            for key, cache_file in cache_files.items()
+            if cache_file.exists()
+        }
+
+    def load_commit(
+        self, commit_hash: str, namespaces: Iterable[str]
+    ) -> dict[str, Any]:
+        return self._load(
+            {
+                namespace: self._get_commit_file(namespace, commit_hash)
+                for namespace in namespaces
+            }
+        )
+
+    def save_commit(self, commit_hash: str, results: dict[str, Any]) -> None:
+        for namespace, data in results.items():
+            self._write(self._get_commit_file(namespace, commit_hash), data)
+
+    def load_blobs(self, namespace: str, keys: Iterable[str]) -> dict[str, Any]:
+        return self._load({key: self._get_blob_file(namespace, key) for key in keys})
+
+    def save_blobs(self, namespace: str, results: dict[str, Any]) -> None:
+        for key, data in results.items():
+            self._write(self._get_blob_file(namespace, key), data)
+
+    def _get_namespace_directories(self) -> Iterator[Path]:
+        for kind in ("commits", "blobs"):
+            if (directory := self._directory / kind).is_dir():
+                yield from directory.iterdir()
+
+    def get_namespaces(self) -> set[str]:
+        return {directory.name for directory in self._get_namespace_directories()}
+
+    def remove_namespace(self, namespace: str) -> None:
+        for directory in self._get_namespace_directories():
+            if directory.name == namespace:
+                shutil.rmtree(directory)
+
+    def evict(self, max_size: int) -> int:
+        entries = [
+            (stat.st_mtime, stat.st_size, path)
+            for directory in self._get_namespace_directories()
+            for path in directory.glob("*/*.json")
+            if (stat := path.stat())
+        ]
+        size = sum(entry_size for _, entry_size, _ in entries)
+        freed = 0
+        for _, entry_size, path in sorted(entries):
+            if size - freed <= max_size:
+                break
+            path.unlink()
+            freed += entry_size
+        return freed
+
+
+class SQLiteCache:
+    # All results in a single database file, shared by all workers (WAL mode
+    # allows concurrent readers alongside a writer).
+    def __init__(self, path: Path, *, compression: CacheCompression) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS commits ("
+                "commit_hash TEXT, namespace TEXT, data BLOB, accessed INTEGER, "
+                "PRIMARY KEY (commit_hash, namespace)) WITHOUT ROWID"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "namespace TEXT, key TEXT, data BLOB, accessed INTEGER, "
+                "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+            )
+        self._compression = compression
+
+    def _encode(self, data: Any) -> bytes:
+        encoded = json.dumps(data).encode()
+        match self._compression:
+            case CacheCompression.NONE:
+                return encoded
+            case CacheCompression.ZLIB:
+                return zlib.compress(encoded)
+            case CacheCompression.ZSTD:
+                import zstandard  # type: ignore[import]
+
+                return cast(bytes, zstandard.ZstdCompressor().compress(encoded))
+
+    def _decode(self, encoded: bytes) -> Any:
+        # Detect the compression of each entry, so that changing the setting
+        # doesn't invalidate existing entries. JSON never starts with 'x' (zlib).
+        if encoded.startswith(ZSTD_MAGIC):
+            import zstandard  # type: ignore[import]
+
+            encoded = zstandard.ZstdDecompressor().decompress(encoded)
+        elif encoded.startswith(b"x"):
+            encoded = zlib.decompress(encoded)
+        return json.loads(encoded)
+
+    def load_commit(
+        self, commit_hash: str, namespaces: Iterable[str]
+    ) -> dict[str, Any]:
+        namespaces = set(namespaces)
+        results = {}
+        stale_namespaces = []
+        now = int(time.time())
+        for namespace, data, accessed in self._connection.execute(
+            "SELECT namespace, data, accessed FROM commits WHERE commit_hash = ?",
+            (commit_hash,),
+        ):
+            if namespace in namespaces:
+                results[namespace] = self._decode(data)
+                if accessed < now - ACCESS_TIME_RESOLUTION:
+                    stale_namespaces.append(namespace)
+        # Writes take the database's only write lock, avoid them when possible.
+        if stale_namespaces:
+            with self._connection:
+                self._connection.executemany(
+                    "UPDATE commits SET accessed = ? "
+                    "WHERE commit_hash = ? AND namespace = ?",
+                    ((now, commit_hash, namespace) for namespace in stale_namespaces),
+                )
+        return results
+
+    def save_commit(self, commit_hash: str, results: dict[str, Any]) -> None:
+        now = int(time.time())
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?)",
+                (
+                    (commit_hash, namespace, self._encode(data), now)
+                    for namespace, data in results.items()
+                ),
+            )
+
+    def load_blobs(self, namespace: str, keys: Iterable[str]) -> dict[str, Any]:
+        results = {}
+        stale_keys = []
+        keys = list(keys)
+        now = int(time.time())
+        for start in range(0, len(keys), SQLITE_BATCH_SIZE):
+            batch = keys[start : start + SQLITE_BATCH_SIZE]
+            placeholders = ", ".join("?" * len(batch))
+            for key, data, accessed in self._connection.execute(
+                "SELECT key, data, accessed FROM blobs "
+                f"WHERE namespace = ? AND key IN ({placeholders})",
+                (namespace, *batch),
+            ):
+                results[key] = self._decode(data)
+                if accessed < now - ACCESS_TIME_RESOLUTION:
+                    stale_keys.append(key)
+        # Writes take the database's only write lock, avoid them when possible.
+        if stale_keys:
+            with self._connection:
+                self._connection.executemany(
+                    "UPDATE blobs SET accessed = ? WHERE namespace = ? AND key = ?",
+                    ((now, namespace, key) for key in stale_keys),
+                )
+        return results
+
+    def save_blobs(self, namespace: str, results: dict[str, Any]) -> None:
+        now = int(time.time())
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)",
+                (
+                    (namespace, key, self._encode(data), now)
+                    for key, data in results.items()
+                ),
+            )
+
+    def get_namespaces(self) -> set[str]:
+        return {
+            namespace
+            for table in ("commits", "blobs")
+            for (namespace,) in self._connection.execute(
+                f"SELECT DISTINCT namespace FROM {table}"
+            )
+        }
+
+    def remove_namespace(self, namespace: str) -> None:
+        with self._connection:
+            for table in ("commits", "blobs"):
+                self._connection.execute(
+                    f"DELETE FROM {table} WHERE namespace = ?", (namespace,)
+                )
+
+    def evict(self, max_size: int) -> int:
+        entries = sorted(
+            (accessed, size, table, key_column, namespace, key)
+            for table, key_column in (("commits", "commit_hash"), ("blobs", "key"))
+            for namespace, key, size, accessed in self._connection.execute(
+                f"SELECT namespace, {key_column}, length(data), accessed FROM {table}"
+            )
+        )
+        size = sum(entry[1] for entry in entries)
+        freed = 0
+        with self._connection:
+            for _, entry_size, table, key_column, namespace, key in entries:
+                if size - freed <= max_size:
+                    break
+                self._connection.execute(
+                    f"DELETE FROM {table} WHERE namespace = ? AND {key_column} = ?",
+                    (namespace, key),
+                )
+                freed += entry_size
+        # Deleted pages are only given back to the file system by a vacuum.
+        self._connection.execute("VACUUM")
+        return freed
+
+
+_cache_backends: dict[tuple[int, Path], CacheBackend] = {}
+
+
+def get_cache_backend(cache: Config.Cache) -> CacheBackend:
+    # Connections can't be shared with forked worker processes, so each process
+    # opens its own backend the first time it needs one.
+    key = (os.getpid(), cache.directory)
+    if key not in _cache_backends:
+        match cache.backend:
+            case CacheBackendType.DIRECTORY:
+                _cache_backends[key] = DirectoryCache(cache.directory)
+            case CacheBackendType.SQLITE:
+                _cache_backends[key] = SQLiteCache(
+                    cache.directory / "cache.sqlite3", compression=cache.compression
+                )
+    return _cache_backends[key]
+
+
+def _get_namespace(analyzer_type: str, analyzer_config: dict[str, Any]) -> str:
+    return hashlib.sha256(
+        json.dumps([analyzer_type, analyzer_config], sort_keys=True).encode()
+    ).hexdigest()
+
+
+def get_commit_namespace(analyzer: Any) -> str:
+    # Any change to an analyzer's configuration results in a new namespace, so
+    # stale results are never looked at and don't need to be removed.
+    return _get_namespace(type(analyzer).__name__, asdict(analyzer))
+
+
+def get_blob_namespace(analyzer: AnalyzerConfig) -> str:
+    analyzer_config = asdict(analyzer)
+    # The glob only selects files, per-file results don't depend on it. Leaving
+    # it out lets analyzers that only differ in their glob share results.
+    analyzer_config.pop("files_glob", None)
+    return _get_namespace(type(analyzer).__name__, analyzer_config)
+
+
+def get_commit_namespaces(analyzers: dict[str, Any]) -> dict[str, str]:
+    return {
+        analyzer_name: get_commit_namespace(analyzer)
+        for analyzer_name, analyzer in analyzers.items()
+    }
+
+
+def _load_cache_meta(cache: Config.Cache) -> dict[str, Any]:
+    if (cache_meta_path := cache.directory / "meta.json").exists():
         logger.debug("Cache meta.json exists, loading")
         cache_meta = cast(dict, json.loads(cache_meta_path.read_text()))
     else:
         logger.debug("Cache meta.json doesn't exist")
-        cache_meta = {"analyzers": {}}
+        cache_meta = {}
+    cache_meta.setdefault("namespaces", {})
+    return cache_meta
+
+
+def _save_cache_meta(cache: Config.Cache, cache_meta: dict[str, Any]) -> None:
+    cache_meta_path = cache.directory / "meta.json"
+    cache_meta_path.parent.mkdir(parents=True, exist_ok=True)
+    # Several runs may share the same cache, don't leave a half-written file.
+    tmp_path = cache_meta_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(cache_meta))
+    tmp_path.replace(cache_meta_path)
+
+
+def update_cache_meta(config: Config) -> None:
+    if not config.cache:
+        logger.debug("No cache configured, skipping meta.json update")
+        return
+    cache_meta = _load_cache_meta(config.cache)
+    now = time.time()
     for analyzer_name, analyzer in config.analyzers.items():
-        if cast(dict, cache_meta["analyzers"]).get(analyzer_name) != asdict(analyzer):
-            logger.debug(
-                f"Cached results for '{analyzer_name}' don't match config, removing"
-            )
-            for file in config.cache.directory.glob(f"**/{analyzer_name}.json"):
-                file.unlink()
-        cache_meta["analyzers"][analyzer_name] = asdict(analyzer)
+        namespaces = [get_commit_namespace(analyzer)]
+        if isinstance(
+            analyzer,
+            (Config.Analyzers.Grep, Config.Analyzers.SCC, Config.Analyzers.LOC),
+        ):
+            namespaces.append(get_blob_namespace(analyzer))
+        for namespace in namespaces:
+            cache_meta["namespaces"][namespace] = {
+                "analyzer": analyzer_name,
+                "config": asdict(analyzer),
+                "last_used": now,
+            }
     logger.debug("Updating cache meta.json with current configuration")
-    cache_meta_path.parent.mkdir(parents=True, exist_ok=True)
-    cache_meta_path.write_text(json.dumps(cache_meta))
+    _save_cache_meta(config.cache, cache_meta)
+
 
+def _remove_legacy_entries(cache: Config.Cache, cache_meta: dict[str, Any]) -> None:
+    # Before namespaces, results were stored as <first hex digit>/<commit
+    # hash>/<analyzer name>.json, and meta.json had the config of each analyzer.
+    for directory in cache.directory.glob("[0-9a-f]"):
+        if directory.is_dir():
+            logger.info(f"Removing legacy cache entries in {directory}")
+            shutil.rmtree(directory)
+    cache_meta.pop("analyzers", None)
 
-def _get_cache_file(
-    cache: Config.Cache, *, commit_hash: str, analyzer_name: str
-) -> Path:
-    return cache.directory / commit_hash[0] / commit_hash / f"{analyzer_name}.json"
+
+def collect_garbage(cache: Config.Cache) -> None:
+    backend = get_cache_backend(cache)
+    cache_meta = _load_cache_meta(cache)
+    _remove_legacy_entries(cache, cache_meta)
+    oldest_last_used = time.time() - cache.max_age * 24 * 60 * 60
+    # Results of analyzer configurations that haven't been used in a while (or
+    # that were never recorded) are dropped as a whole.
+    for namespace in backend.get_namespaces() | set(cache_meta["namespaces"]):
+        namespace_meta = cache_meta["namespaces"].get(namespace)
+        if namespace_meta and namespace_meta["last_used"] >= oldest_last_used:
+            continue
+        logger.info(f"Removing unused cache namespace {namespace}")
+        backend.remove_namespace(namespace)
+        cache_meta["namespaces"].pop(namespace, None)
+    _save_cache_meta(cache, cache_meta)
+    if cache.max_size is not None:
+        freed = backend.evict(cache.max_size)
+        logger.info(
+            f"Evicted {freed / 1024 / 1024:.1f} MiB of least recently used results"
+        )
 
 
 def load_from_cache(
-    cache: Config.Cache, *, commit_hash: str, analyzer_name: str
-) -> dict | None:
-    cache_file = _get_cache_file(
-        cache, commit_hash=commit_hash, analyzer_name=analyzer_name
-    )
-    if not cache_file.exists():
-        logger.debug(
-            f"No results for '{analyzer_name}' @ {commit_hash} in cache",
+    cache: Config.Cache, *, tree_hash: str, namespaces: dict[str, str]
+) -> dict[str, Any]:
+    # Results only depend on a commit's files, so commits with the same tree
+    # (e.g. merges and reverts) share them.
+    with measure("cache_load"):
+        cached_results = get_cache_backend(cache).load_commit(
+            tree_hash, namespaces.values()
         )
-        return None
+    results = {
+        analyzer_name: cached_results[namespace]
+        for analyzer_name, namespace in namespaces.items()
+        if namespace in cached_results
+    }
+    count("commit_cache_hits", len(results))
+    count("commit_cache_misses", len(namespaces) - len(results))
     logger.debug(
-        f"Loading results for '{analyzer_name}' @ {commit_hash} from cache",
+        f"Loaded results for {list(results)} @ {tree_hash} from cache",
     )
-    return json.loads(cache_file.read_text())
+    return results
 
 
 def save_to_cache(
-    cache: Config.Cache, *, commit_hash: str, analyzer_name: str, data: dict
+    cache: Config.Cache,
+    *,
+    tree_hash: str,
+    namespaces: dict[str, str],
+    results: dict[str, Any],
 ) -> None:
     logger.debug(
-        f"Saving results for '{analyzer_name}' @ {commit_hash} to cache",
-    )
-    cache_file = _get_cache_file(
-        cache, commit_hash=commit_hash, analyzer_name=analyzer_name
+        f"Saving results for {list(results)} @ {tree_hash} to cache",
     )
-    cache_file.parent.mkdir(parents=True, exist_ok=True)
-    cache_file.write_text(json.dumps(data))
+    with measure("cache_save"):
+        get_cache_backend(cache).save_commit(
+            tree_hash,
+            {
+                namespaces[analyzer_name]: data
+                for analyzer_name, data in results.items()
+            },
+        )
+
+
+@dataclass
+class BlobCache:
+    cache: Config.Cache
+    namespace: str
+
+
+def get_blob_cache(cache: Config.Cache, analyzer: AnalyzerConfig) -> BlobCache:
+    return BlobCache(cache=cache, namespace=get_blob_namespace(analyzer))
+
+
+def load_blobs_from_cache(blob_cache: BlobCache, keys: Iterable[str]) -> dict[str, Any]:
+    keys = set(keys)
+    with measure("blob_cache_load"):
+        results = get_cache_backend(blob_cache.cache).load_blobs(
+            blob_cache.namespace, keys
+        )
+    count("blob_cache_hits", len(results))
+    count("blob_cache_misses", len(keys) - len(results))
+    return results
+
+
+def save_blobs_to_cache(blob_cache: BlobCache, results: dict[str, Any]) -> None:
+    with measure("blob_cache_save"):
+        get_cache_backend(blob_cache.cache).save_blobs(blob_cache.namespace, results)
+
+
+def run_with_blob_cache(
+    blob_cache: BlobCache | None,
+    files: Iterable[TrackedFile],
+    analyze: Callable[[list[TrackedFile]], dict[str, Any]],
+    *,
+    key: Callable[[TrackedFile], str] = lambda file: file.blob_hash,
+) -> dict[str, Any]:
+    files = list(files)
+    if not blob_cache:
+        return analyze(files)
+    keys = {file.path: key(file) for file in files}
+    results = load_blobs_from_cache(blob_cache, set(keys.values()))
+    if uncached_files := [file for file in files if keys[file.path] not in results]:
+        logger.debug(
+            f"{len(uncached_files)}/{len(files)} files not in blob cache, analyzing"
+        )
+        new_results = analyze(uncached_files)
+        # Also remember files without results so they're not analyzed again.
+        uncached_results = {
+            keys[file.path]: new_results.get(file.path) for file in uncached_files
+        }
+        save_blobs_to_cache(blob_cache, uncached_results)
+        results |= uncached_results
+    return {
+        file.path: result
+        for file in files
+        if (result := results[keys[file.path]]) is not None
+    }
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from stats.config import CheckoutSetup
+from stats.git import git
+from stats.metrics import measure
+
+
+logger = logging.getLogger(__name__)
+
+
+def _reuse_checkout(checkout: Path) -> None:
+    logger.info(f"Reusing existing checkout {checkout}")
+    # A previous run may have been interrupted in the middle of a checkout.
+    git(checkout, "reset", "--hard", "--quiet")
+    git(checkout, "clean", "-d", "-x", "--force", "--quiet")
+
+
+def _clone(repository: Path, checkout: Path, *args: str) -> None:
+    with measure("clone", checkout=str(checkout)):
+        if (checkout / ".git").exists():
+            git(checkout, "fetch", "--quiet", "origin")
+            if "--no-checkout" not in args:
+                _reuse_checkout(checkout)
+            return
+        logger.info(f"Cloning repository to {checkout}")
+        git(repository, "clone", "--quiet", *args, ".", str(checkout))
+
+
+def _add_worktree(base: Path, checkout: Path) -> None:
+    with measure("clone", checkout=str(checkout)):
+        if (checkout / ".git").exists():
+            _reuse_checkout(checkout)
+            return
+        logger.info(f"Adding worktree {checkout}")
+        git(base, "worktree", "add", "--quiet", "--detach", str(checkout))
+
+
+def create_checkouts(
+    repository: Path, directory: Path, *, count: int, setup: CheckoutSetup
+) -> list[Path]:
+    # Clone provided repo to /tmp (or the configured directory) to:
+    # - avoid untracked files when checking out earlier commits
+    # - speed up the checkout process
+    checkouts = [directory / str(index) / repository.name for index in range(count)]
+    if not checkouts:
+        return checkouts
+    match setup:
+        case CheckoutSetup.CLONE | CheckoutSetup.SHARED:
+            # Objects are either copied (or hardlinked) or borrowed from the
+            # provided repo with --shared, in both cases clones are independent
+            # of each other and can be created at the same time.
+            args = ("--shared",) if setup is CheckoutSetup.SHARED else ()
+            with ThreadPoolExecutor(max_workers=count) as executor:
+                for _ in executor.map(
+                    lambda checkout: _clone(repository, checkout, *args), checkouts
+                ):
+                    pass
+        case CheckoutSetup.WORKTREE:
+            # A single copy of all objects, shared by all worktrees. Adding
+            # worktrees locks the base repository, so do it one after another.
+            base = directory / "base" / repository.name
+            _clone(repository, base, "--no-checkout")
+            for checkout in checkouts:
+                _add_worktree(base, checkout)
+    return checkouts
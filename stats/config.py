@@ -12,6 +12,42 @@ class CommitSampling(Enum):
     ALL = "ALL"
     LAST = "LAST"
     DAILY = "DAILY"
+    WEEKLY = "WEEKLY"
+    MONTHLY = "MONTHLY"
+    ADAPTIVE = "ADAPTIVE"
+
+
+class Engine(Enum):
+    WORKTREE = "WORKTREE"
+    BLOBS = "BLOBS"
+
+
+class OutputFormat(Enum):
+    JSON = "JSON"
+    NDJSON = "NDJSON"
+    NPY = "NPY"
+
+
+class CacheBackendType(Enum):
+    DIRECTORY = "DIRECTORY"
+    SQLITE = "SQLITE"
+
+
+class CacheCompression(Enum):
+    NONE = "NONE"
+    ZLIB = "ZLIB"
+    ZSTD = "ZSTD"
+
+
+class OrchestrationMode(Enum):
+    POOL = "POOL"
+    ASYNCIO = "ASYNCIO"
+
+
+class CheckoutSetup(Enum):
+    CLONE = "CLONE"
+    SHARED = "SHARED"
+    WORKTREE = "WORKTREE"
 
 
 @dataclass
@@ -19,11 +55,51 @@ class Config:
     @dataclass
     class Cache:
         directory: Path
+        backend: CacheBackendType
+        compression: CacheCompression
+        max_size: int | None
+        max_age: int
+
+    @dataclass
+    class Commits:
+        revisions: list[str]
+        since: str | None
+        until: str | None
+        first_parent: bool
+        max_count: int | None
+        every: int
+
+    @dataclass
+    class Coordinator:
+        address: str
+        authkey: str
+        batch_size: int
+        batch_timeout: int
+
+    @dataclass
+    class AdaptiveSampling:
+        initial_commits: int
+        threshold: float
+        max_commits: int | None
+
+    @dataclass
+    class Checkouts:
+        setup: CheckoutSetup
+        directory: Path | None
+
+    @dataclass
+    class Orchestration:
+        mode: OrchestrationMode
+        max_git_processes: int
 
     @dataclass
     class Logging:
         level: str
 
+    @dataclass
+    class Metrics:
+        trace: Path | None
+
     class Analyzers:
         @dataclass
         class _Base:
@@ -38,38 +114,136 @@ class Config:
         class Grep(_Base):
             regex: str
             case_insensitive: bool
+            binary_files: bool
+            max_file_size: int | None
 
         @dataclass
         class SCC(_Base): ...
 
+        @dataclass
+        class LOC(_Base): ...
+
     repository: Path
     output: Path
+    output_format: OutputFormat
+    rollup: bool
+    append: bool
     processes: int
+    chunk_size: int | None
+    commits: Commits
     commit_sampling: CommitSampling
+    adaptive_sampling: AdaptiveSampling
+    incremental: bool
+    engine: Engine
+    checkouts: Checkouts
+    orchestration: Orchestration
+    coordinator: Coordinator
     cache: Cache | None
     logging: Logging
-    analyzers: dict[str, Analyzers.Grep | Analyzers.SCC]
+    metrics: Metrics
+    analyzers: dict[str, Analyzers.Grep | Analyzers.SCC | Analyzers.LOC]
+
+
+AnalyzerConfig: TypeAlias = (
+    Config.Analyzers.Grep | Config.Analyzers.SCC | Config.Analyzers.LOC
+)
 
+SIZE_SUFFIXES = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
 
-AnalyzerConfig: TypeAlias = Config.Analyzers.Grep | Config.Analyzers.SCC
+
+def parse_size(size: int | str) -> int:
+    # Either a plain number of bytes, or a string like "500M" or "2G".
+    if isinstance(size, int):
+        return size
+    size = size.strip().upper().removesuffix("B")
+    if size and size[-1] in SIZE_SUFFIXES:
+        return int(float(size[:-1]) * SIZE_SUFFIXES[size[-1]])
+    return int(size)
 
 
 def load_config(path: Path) -> Config:
     with path.open("rb") as f:
         config = tomllib.load(f)
     config_dir = path.parent
+    checkouts_config = cast(dict, config.get("checkouts", {}))
+    orchestration_config = cast(dict, config.get("orchestration", {}))
+    metrics_config = cast(dict, config.get("metrics", {}))
+    adaptive_sampling_config = cast(dict, config.get("adaptive_sampling", {}))
+    commits_config = cast(dict, config.get("commits", {}))
+    coordinator_config = cast(dict, config.get("coordinator", {}))
+    revisions = cast(str | list[str], commits_config.get("revisions", ["HEAD"]))
+    processes = cast(int, config.get("processes", cpu_count()))
     return Config(
         repository=(config_dir / Path(cast(str, config["repository"]))).resolve(),
         output=(config_dir / Path(cast(str, config["output"]))).resolve(),
-        processes=cast(int, config.get("processes", cpu_count())),
+        output_format=OutputFormat(
+            cast(str, config.get("output_format", "json")).upper()
+        ),
+        rollup=cast(bool, config.get("rollup", False)),
+        append=cast(bool, config.get("append", False)),
+        processes=processes,
+        chunk_size=cast(int | None, config.get("chunk_size")),
+        commits=Config.Commits(
+            revisions=[revisions] if isinstance(revisions, str) else revisions,
+            since=cast(str | None, commits_config.get("since")),
+            until=cast(str | None, commits_config.get("until")),
+            first_parent=cast(bool, commits_config.get("first_parent", False)),
+            max_count=cast(int | None, commits_config.get("max_count")),
+            every=cast(int, commits_config.get("every", 1)),
+        ),
         commit_sampling=CommitSampling(
             cast(str, config.get("commit_sampling", "all")).upper()
         ),
+        adaptive_sampling=Config.AdaptiveSampling(
+            initial_commits=cast(
+                int, adaptive_sampling_config.get("initial_commits", 100)
+            ),
+            threshold=cast(float, adaptive_sampling_config.get("threshold", 0.01)),
+            max_commits=cast(int | None, adaptive_sampling_config.get("max_commits")),
+        ),
+        incremental=cast(bool, config.get("incremental", False)),
+        engine=Engine(cast(str, config.get("engine", "worktree")).upper()),
+        checkouts=Config.Checkouts(
+            setup=CheckoutSetup(
+                cast(str, checkouts_config.get("setup", "clone")).upper()
+            ),
+            directory=(
+                (config_dir / Path(cast(str, directory))).resolve()
+                if (directory := checkouts_config.get("directory"))
+                else None
+            ),
+        ),
+        orchestration=Config.Orchestration(
+            mode=OrchestrationMode(
+                cast(str, orchestration_config.get("mode", "pool")).upper()
+            ),
+            max_git_processes=cast(
+                int, orchestration_config.get("max_git_processes", processes)
+            ),
+        ),
+        coordinator=Config.Coordinator(
+            address=cast(str, coordinator_config.get("address", "localhost:8642")),
+            authkey=cast(str, coordinator_config.get("authkey", "stats")),
+            batch_size=cast(int, coordinator_config.get("batch_size", 100)),
+            batch_timeout=cast(int, coordinator_config.get("batch_timeout", 3600)),
+        ),
         cache=(
             Config.Cache(
                 directory=(
                     config_dir / Path(cast(str, cache_config["directory"]))
-                ).resolve()
+                ).resolve(),
+                backend=CacheBackendType(
+                    cast(str, cache_config.get("backend", "directory")).upper()
+                ),
+                compression=CacheCompression(
+                    cast(str, cache_config.get("compression", "none")).upper()
+                ),
+                max_size=(
+                    parse_size(cast(int | str, max_size))
+                    if (max_size := cache_config.get("max_size")) is not None
+                    else None
+                ),
+                max_age=cast(int, cache_config.get("max_age", 30)),
             )
             if (cache_config := config.get("cache"))
             else None
@@ -77,6 +251,13 @@ def load_config(path: Path) -> Config:
         logging=Config.Logging(
             level=cast(str, config.get("logging", {}).get("level", "INFO")),
         ),
+        metrics=Config.Metrics(
+            trace=(
+                (config_dir / Path(cast(str, trace))).resolve()
+                if (trace := metrics_config.get("trace"))
+                else None
+            ),
+        ),
         analyzers={
             analyzer_name: cast(
                 dict[str, Callable[[], AnalyzerConfig]],
@@ -87,6 +268,15 @@ def load_config(path: Path) -> Config:
                         case_insensitive=cast(
                             bool, analyzer_config.get("case_insensitive", False)
                         ),
+                        binary_files=cast(
+                            bool, analyzer_config.get("binary_files", False)
+                        ),
+                        max_file_size=(
+                            parse_size(cast(int | str, max_file_size))
+                            if (max_file_size := analyzer_config.get("max_file_size"))
+                            is not None
+                            else None
+                        ),
                     ),
                     "grep_commits": lambda: Config.Analyzers.GrepCommits(
                         regex=cast(str, analyzer_config["regex"]),
@@ -97,6 +287,9 @@ def load_config(path: Path) -> Config:
                     "scc": lambda: Config.Analyzers.SCC(
                         files_glob=cast(str | None, analyzer_config.get("files_glob")),
                     ),
+                    "loc": lambda: Config.Analyzers.LOC(
+                        files_glob=cast(str | None, analyzer_config.get("files_glob")),
+                    ),
                 },
             )[analyzer_config["type"]]()
             for analyzer_name, analyzer_config in cast(
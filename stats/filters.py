@@ -1,6 +1,9 @@
 from __future__ import annotations
 
+import datetime
 import fnmatch
+import itertools
+from collections import deque
 from pathlib import Path
 from typing import Callable, Iterable, Iterator, TypeVar, cast
 
@@ -30,17 +33,30 @@ def filter_files(
 
 
 def filter_commits(
-    commits: Iterable[Commit], *, commit_sampling: CommitSampling
+    commits: Iterable[Commit], *, commit_sampling: CommitSampling, every: int = 1
 ) -> Iterator[Commit]:
+    commits = itertools.islice(commits, None, None, every)
     match commit_sampling:
         case CommitSampling.ALL:
             yield from commits
         case CommitSampling.LAST:
-            *_, last = commits
-            yield last
+            yield from deque(commits, maxlen=1)
+        case CommitSampling.ADAPTIVE:
+            # Sampled while analyzing, see stats.sampling.
+            yield from commits
         case CommitSampling.DAILY:
-            seen_days = set()
-            for commit in commits:
-                if (date := commit.timestamp.date()) not in seen_days:
-                    seen_days.add(date)
-                    yield commit
+            yield from _first_per_bucket(commits, lambda date: date)
+        case CommitSampling.WEEKLY:
+            yield from _first_per_bucket(commits, lambda date: date.isocalendar()[:2])
+        case CommitSampling.MONTHLY:
+            yield from _first_per_bucket(commits, lambda date: (date.year, date.month))
+
+
+def _first_per_bucket(
+    commits: Iterable[Commit], get_bucket: Callable[[datetime.date], object]
+) -> Iterator[Commit]:
+    seen_buckets = set()
+    for commit in commits:
+        if (bucket := get_bucket(commit.timestamp.date())) not in seen_buckets:
+            seen_buckets.add(bucket)
+            yield commit
@@ -1,23 +1,69 @@
 from __future__ import annotations
 
+import asyncio
 import datetime
 import logging
+import mmap
+import os
+import resource
 import subprocess
-from dataclasses import dataclass
+import time
+from contextlib import AbstractContextManager, contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterator
+from tempfile import TemporaryDirectory, TemporaryFile
+from typing import IO, Iterable, Iterator, Protocol, TypeAlias, cast
+
+from stats.metrics import measure
 
 logger = logging.getLogger(__name__)
 
 
-@dataclass
+# Slotted, there can be millions of these.
+@dataclass(slots=True)
 class Commit:
+    # Full hash, abbreviated ones can become ambiguous as history grows.
     hash: str
     timestamp: datetime.datetime
+    # Commits with the same tree have the same files, and thus the same results.
+    tree: str
 
 
-def git(repository: Path, *args: str) -> str:
-    args = (
+@dataclass
+class CommitMetadata:
+    hash: str
+    author_name: str
+    author_email: str
+    message: str
+
+
+@dataclass(frozen=True)
+class TrackedFile:
+    path: str
+    blob_hash: str
+
+
+@dataclass
+class FileChanges:
+    # Files that were added or modified, including rename destinations.
+    changed: list[TrackedFile]
+    # Files that were deleted, including rename sources and files that are no
+    # longer regular files.
+    removed: set[str]
+
+
+# Git also tracks symlinks (120000) and submodules (160000), which we skip.
+REGULAR_FILE_MODES = ("100644", "100755")
+
+# Files at least this large are memory-mapped instead of read into memory, so
+# that workers don't need more memory the larger the largest file is.
+MMAP_THRESHOLD = 1024 * 1024
+
+FileContent: TypeAlias = bytes | mmap.mmap
+
+
+def _git_args(repository: Path, *args: str) -> tuple[str, ...]:
+    return (
         "git",
         "-c",
         "core.quotepath=off",
@@ -26,6 +72,10 @@ def git(repository: Path, *args: str) -> str:
         "--no-pager",
         *args,
     )
+
+
+def git(repository: Path, *args: str) -> str:
+    args = _git_args(repository, *args)
     process = subprocess.run(
         args,
         text=True,
@@ -42,28 +92,304 @@ def git(repository: Path, *args: str) -> str:
     return process.stdout
 
 
-def get_commits(repository: Path) -> Iterator[Commit]:
-    output = git(
-        repository,
-        "log",
-        "--reverse",
-        "--pretty=format:%h %ct",
+async def git_async(repository: Path, *args: str) -> str:
+    # Same as git(), but doesn't block the event loop while git is running.
+    args = _git_args(repository, *args)
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
     )
-    for line in output.splitlines():
-        commit_hash, commit_timestamp = line.split()
+    stdout, _ = await process.communicate()
+    output = stdout.decode("utf-8")
+    if process.returncode:
+        command = " ".join(args)
+        logger.error(f"'{command}' failed:\n{output}")
+        raise subprocess.CalledProcessError(process.returncode, args, output)
+    return output
+
+
+def git_records(
+    repository: Path, *args: str, separator: str = "\0", stdin: str | None = None
+) -> Iterator[str]:
+    # Like git(), but for NUL-separated output (-z) that may be too large to
+    # hold in memory at once, records are yielded as they come in.
+    args = _git_args(repository, *args)
+    with subprocess.Popen(
+        args,
+        text=True,
+        encoding="utf-8",
+        stdin=subprocess.PIPE if stdin is not None else None,
+        stdout=subprocess.PIPE,
+    ) as process:
+        if stdin is not None:
+            # Commands with --stdin read all of it before writing anything.
+            cast(IO[str], process.stdin).write(stdin)
+            cast(IO[str], process.stdin).close()
+        stdout = cast(IO[str], process.stdout)
+        buffer = ""
+        while chunk := stdout.read(64 * 1024):
+            *records, buffer = (buffer + chunk).split(separator)
+            yield from records
+        if buffer:
+            yield buffer
+    if process.returncode:
+        command = " ".join(args)
+        logger.error(f"'{command}' failed")
+        raise subprocess.CalledProcessError(process.returncode, args)
+
+
+def checkout(repository: Path, revision: str) -> tuple[float, int]:
+    start_time = time.perf_counter()
+    start_blocks = resource.getrusage(resource.RUSAGE_CHILDREN).ru_oublock
+    with measure("checkout", revision=revision):
+        git(repository, "checkout", revision)
+    blocks = resource.getrusage(resource.RUSAGE_CHILDREN).ru_oublock - start_blocks
+    # On Linux, ru_oublock counts the 512 byte blocks written by child processes.
+    return time.perf_counter() - start_time, blocks * 512
+
+
+async def checkout_async(repository: Path, revision: str) -> float:
+    start_time = time.perf_counter()
+    with measure("checkout", revision=revision):
+        await git_async(repository, "checkout", revision)
+    return time.perf_counter() - start_time
+
+
+def get_commits(
+    repository: Path,
+    *,
+    revisions: list[str],
+    since: str | None = None,
+    until: str | None = None,
+    first_parent: bool = False,
+    max_count: int | None = None,
+) -> Iterator[Commit]:
+    # Selection happens in git, so only selected commits are ever read here.
+    # --max-count applies before --reverse, i.e. selects the latest commits.
+    args = ["rev-list", "--reverse", "--no-commit-header", "--format=%H %T %ct"]
+    if since:
+        args.append(f"--since={since}")
+    if until:
+        args.append(f"--until={until}")
+    if first_parent:
+        args.append("--first-parent")
+    if max_count is not None:
+        args.append(f"--max-count={max_count}")
+    for line in git_records(repository, *args, *revisions, "--", separator="\n"):
+        if not line:
+            continue
+        commit_hash, tree_hash, commit_timestamp = line.split()
         commit_timestamp_datetime = datetime.datetime.fromtimestamp(
             int(commit_timestamp), datetime.UTC
         )
-        yield Commit(hash=commit_hash, timestamp=commit_timestamp_datetime)
+        yield Commit(
+            hash=commit_hash, timestamp=commit_timestamp_datetime, tree=tree_hash
+        )
+
+
+# Long-lived 'git cat-file --batch' process, much cheaper than spawning git for
+# every object that needs to be read.
+class GitCatFile:
+    def __init__(self, repository: Path) -> None:
+        self._process = subprocess.Popen(
+            _git_args(repository, "cat-file", "--batch"),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    @contextmanager
+    def open(self, object_name: str) -> Iterator[FileContent]:
+        stdin = cast(IO[bytes], self._process.stdin)
+        stdout = cast(IO[bytes], self._process.stdout)
+        stdin.write(f"{object_name}\n".encode())
+        stdin.flush()
+        header = stdout.readline().decode()
+        if header.endswith(" missing\n"):
+            raise KeyError(f"Object {object_name} is missing")
+        _, _, size = header.split()
+        remaining = int(size)
+        if remaining < MMAP_THRESHOLD:
+            data = stdout.read(remaining)
+            # Contents are followed by a newline.
+            stdout.read(1)
+            yield data
+            return
+        # Large blobs are copied to a temporary file in chunks, and mapped from
+        # there.
+        with TemporaryFile(prefix="stats-") as f:
+            while remaining:
+                chunk = stdout.read(min(remaining, MMAP_THRESHOLD))
+                f.write(chunk)
+                remaining -= len(chunk)
+            stdout.read(1)
+            f.flush()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                yield content
+
+    def close(self) -> None:
+        cast(IO[bytes], self._process.stdin).close()
+        self._process.wait()
+
+
+class Tree(Protocol):
+    repository: Path
+    revision: str
+
+    def list_files(self) -> list[TrackedFile]: ...
+
+    def open(self, file: TrackedFile) -> AbstractContextManager[FileContent]: ...
+
+    def materialize(self, files: list[TrackedFile]) -> AbstractContextManager[Path]: ...
+
+
+# Files of the commit that's currently checked out.
+@dataclass
+class Worktree:
+    repository: Path
+    revision: str = "HEAD"
+    _files: list[TrackedFile] | None = field(default=None, init=False, repr=False)
+
+    def list_files(self) -> list[TrackedFile]:
+        # All analyzers of a commit share the same listing.
+        if self._files is None:
+            with measure("list_files"):
+                self._files = list(get_tracked_files(self.repository))
+        return self._files
+
+    @contextmanager
+    def open(self, file: TrackedFile) -> Iterator[FileContent]:
+        with (self.repository / file.path).open("rb") as f:
+            if os.fstat(f.fileno()).st_size < MMAP_THRESHOLD:
+                yield f.read()
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                yield content
+
+    @contextmanager
+    def materialize(self, files: list[TrackedFile]) -> Iterator[Path]:
+        yield self.repository
+
+
+# Files of any commit, read straight from the object database without a
+# checkout.
+@dataclass
+class CommitTree:
+    repository: Path
+    revision: str
+    cat_file: GitCatFile
+    _files: list[TrackedFile] | None = field(default=None, init=False, repr=False)
+
+    def list_files(self) -> list[TrackedFile]:
+        if self._files is None:
+            with measure("list_files"):
+                self._files = list(get_tree_files(self.repository, self.revision))
+        return self._files
+
+    def open(self, file: TrackedFile) -> AbstractContextManager[FileContent]:
+        return self.cat_file.open(file.blob_hash)
+
+    @contextmanager
+    def materialize(self, files: list[TrackedFile]) -> Iterator[Path]:
+        # For tools that need actual files, only write the requested ones.
+        with TemporaryDirectory(prefix="stats-") as tmp_dir:
+            directory = Path(tmp_dir)
+            for file in files:
+                path = directory / file.path
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with self.open(file) as content:
+                    path.write_bytes(content)
+            yield directory
+
+
+def get_tracked_files(repository: Path) -> Iterator[TrackedFile]:
+    output = git(repository, "ls-files", "--stage", "-z")
+    for entry in output.split("\0"):
+        if not entry:
+            continue
+        info, path = entry.split("\t", maxsplit=1)
+        mode, blob_hash, _ = info.split()
+        if mode in REGULAR_FILE_MODES:
+            yield TrackedFile(path=path, blob_hash=blob_hash)
+
+
+def get_commit_metadata(
+    repository: Path, commit_hashes: Iterable[str]
+) -> Iterator[CommitMetadata]:
+    # Exactly the given commits, in the given order.
+    stdin = "".join(f"{commit_hash}\n" for commit_hash in commit_hashes)
+    # Without any revisions, git would fall back to HEAD.
+    if not stdin:
+        return
+    for record in git_records(
+        repository,
+        "log",
+        "--no-walk=unsorted",
+        "--stdin",
+        "-z",
+        "--pretty=format:%H%x1f%an%x1f%ae%x1f%B",
+        stdin=stdin,
+    ):
+        commit_hash, author_name, author_email, message = record.split("\x1f", 3)
+        yield CommitMetadata(
+            hash=commit_hash,
+            author_name=author_name,
+            author_email=author_email,
+            message=message,
+        )
+
+
+def get_file_changes(repository: Path, old_commit: str, new_commit: str) -> FileChanges:
+    with measure("diff"):
+        output = git(
+            repository,
+            "diff",
+            "--raw",
+            "-z",
+            "--no-abbrev",
+            "--no-renames",
+            old_commit,
+            new_commit,
+        )
+    changes = FileChanges(changed=[], removed=set())
+    fields = iter(output.split("\0"))
+    for info in fields:
+        if not info:
+            continue
+        _, new_mode, _, new_blob_hash, status = info.split()
+        # Renames and copies list both the source and the destination path.
+        if status[0] in ("R", "C"):
+            source_path = next(fields)
+            if status[0] == "R":
+                changes.removed.add(source_path)
+        path = next(fields)
+        if new_mode in REGULAR_FILE_MODES:
+            changes.changed.append(TrackedFile(path=path, blob_hash=new_blob_hash))
+        else:
+            changes.removed.add(path)
+    return changes
 
 
-def get_files(repository: Path) -> Iterator[Path]:
-    output = git(repository, "ls-files")
-    for line in output.splitlines():
-        # Git also lists symlinks, skip those.
-        if (path := repository / line).is_file():
-            yield path
+def get_tree_files(repository: Path, revision: str) -> Iterator[TrackedFile]:
+    output = git(repository, "ls-tree", "-r", "-z", revision)
+    for entry in output.split("\0"):
+        if not entry:
+            continue
+        info, path = entry.split("\t", maxsplit=1)
+        mode, _, blob_hash = info.split()
+        if mode in REGULAR_FILE_MODES:
+            yield TrackedFile(path=path, blob_hash=blob_hash)
 
 
-def get_commit_texts(repository: Path) -> str:
-    return git(repository, "log", "--pretty=format:%B", "HEAD~1..HEAD")
+def get_tree_file_sizes(
+    repository: Path, revision: str
+) -> Iterator[tuple[TrackedFile, int]]:
+    # Like get_tree_files(), with the size of each blob.
+    output = git(repository, "ls-tree", "-r", "-l", "-z", revision)
+    for entry in output.split("\0"):
+        if not entry:
+            continue
+        info, path = entry.split("\t", maxsplit=1)
+        mode, _, blob_hash, size = info.split()
+        if mode in REGULAR_FILE_MODES:
+            yield TrackedFile(path=path, blob_hash=blob_hash), int(size)
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterator
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Metrics:
+    # Chrome trace_event "complete" events, see
+    # https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+    events: list[dict[str, Any]] = field(default_factory=list)
+    counters: Counter[str] = field(default_factory=Counter)
+
+
+# Metrics of the current process since they were last collected.
+_metrics = Metrics()
+
+
+@contextmanager
+def measure(name: str, **args: Any) -> Iterator[dict[str, Any]]:
+    # The args are yielded, so that more can be added once they're known.
+    start = time.perf_counter_ns()
+    try:
+        yield args
+    finally:
+        end = time.perf_counter_ns()
+        _metrics.events.append(
+            {
+                "name": name,
+                "ph": "X",
+                # perf_counter() is CLOCK_MONOTONIC on Linux, which is the same
+                # across processes, so events of all workers line up.
+                "ts": start / 1000,
+                "dur": (end - start) / 1000,
+                "pid": os.getpid(),
+                "tid": threading.get_native_id(),
+                "args": args,
+            }
+        )
+
+
+def count(name: str, value: int = 1) -> None:
+    _metrics.counters[name] += value
+
+
+def get_counters() -> Counter[str]:
+    return _metrics.counters.copy()
+
+
+def collect() -> Metrics:
+    global _metrics
+    metrics, _metrics = _metrics, Metrics()
+    return metrics
+
+
+@dataclass
+class StageSummary:
+    count: int = 0
+    seconds: float = 0.0
+
+
+class MetricsSummary:
+    def __init__(self, *, keep_events: bool) -> None:
+        self._keep_events = keep_events
+        self.events: list[dict[str, Any]] = []
+        self.stages: defaultdict[str, StageSummary] = defaultdict(StageSummary)
+        self.workers: defaultdict[int, StageSummary] = defaultdict(StageSummary)
+        self.counters: Counter[str] = Counter()
+
+    def add(self, metrics: Metrics) -> None:
+        for event in metrics.events:
+            stage = self.stages[event["name"]]
+            stage.count += 1
+            stage.seconds += event["dur"] / 1_000_000
+            if event["name"] == "commit":
+                worker = self.workers[event["pid"]]
+                worker.count += 1
+                worker.seconds += event["dur"] / 1_000_000
+        self.counters.update(metrics.counters)
+        if self._keep_events:
+            self.events.extend(metrics.events)
+
+    def log(self) -> None:
+        # Stages can be nested (e.g. analyzers listing files), so the times of
+        # all stages don't add up to the total.
+        width = max(map(len, self.stages), default=0)
+        logger.info(f"{'Stage':<{width}} {'Count':>8} {'Total':>10} {'Mean':>10}")
+        for name, stage in sorted(self.stages.items(), key=lambda item: item[0]):
+            logger.info(
+                f"{name:<{width}} {stage.count:>8} {stage.seconds:>9.2f}s "
+                f"{stage.seconds / stage.count * 1000:>8.2f}ms"
+            )
+        for pid, worker in sorted(self.workers.items()):
+            logger.info(
+                f"Worker {pid}: {worker.count} commits in {worker.seconds:.2f}s"
+            )
+        for name, value in sorted(self.counters.items()):
+            logger.info(f"{name}: {value}")
+
+    def write_trace(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(
+            json.dumps({"traceEvents": self.events, "displayTimeUnit": "ms"})
+        )
@@ -0,0 +1,390 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import shutil
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import IO, Any, Iterator, Protocol
+
+from stats.config import OutputFormat
+
+
+logger = logging.getLogger(__name__)
+
+# Records written between checkpoints of appended output, at most this many are
+# analyzed again after a crash.
+CHECKPOINT_INTERVAL = 100
+
+
+class OutputWriter(Protocol):
+    def write(self, record: dict[str, Any]) -> None: ...
+
+
+class JSONWriter:
+    # Writes the same JSON array json.dumps() would, one record at a time.
+    def __init__(self, file: IO[str], *, resume: bool = False) -> None:
+        # When resuming, the file already contains the start of the array.
+        self._file = file
+        if not resume:
+            self._file.write("[")
+        self._empty = not resume
+
+    def write(self, record: dict[str, Any]) -> None:
+        # A single write, so that an interrupted run never leaves a dangling
+        # separator behind.
+        self._file.write(("" if self._empty else ", ") + json.dumps(record))
+        self._empty = False
+
+    def close(self) -> None:
+        self._file.write("]")
+
+
+class NDJSONWriter:
+    def __init__(self, file: IO[str]) -> None:
+        self._file = file
+
+    def write(self, record: dict[str, Any]) -> None:
+        self._file.write(json.dumps(record))
+        self._file.write("\n")
+        # Make each record visible as soon as it's written.
+        self._file.flush()
+
+    def close(self) -> None:
+        pass
+
+
+@dataclass
+class _AnalyzerColumns:
+    # Row indices of each commit's results, commit i spans offsets[i]:offsets[i + 1].
+    offsets: array[int]
+    paths: array[int] = field(default_factory=lambda: array("q"))
+    # Results that aren't dicts (e.g. grep counts) are stored as a "value" field.
+    scalar: bool = False
+    kinds: dict[str, str] = field(default_factory=dict)
+    fields: dict[str, array[Any]] = field(default_factory=dict)
+
+
+class NPYWriter:
+    # Columnar output as a directory of .npy files that can be memory-mapped.
+    # Paths and other strings are stored once in a shared table and referenced
+    # by index, numeric fields are stored as typed arrays.
+    def __init__(self, directory: Path) -> None:
+        self._directory = directory
+        self._commits: list[str] = []
+        self._timestamps = array("d")
+        self._strings: dict[str, int] = {}
+        self._analyzers: dict[str, _AnalyzerColumns] = {}
+
+    def _intern(self, string: str) -> int:
+        return self._strings.setdefault(string, len(self._strings))
+
+    def _append_row(self, columns: _AnalyzerColumns, values: dict[str, Any]) -> None:
+        row_count = len(columns.paths) - 1
+        for name, value in values.items():
+            if name not in columns.fields:
+                kind = (
+                    "string"
+                    if isinstance(value, str)
+                    else "float" if isinstance(value, float) else "int"
+                )
+                columns.kinds[name] = kind
+                columns.fields[name] = array(
+                    "d" if kind == "float" else "q", [0] * row_count
+                )
+            match columns.kinds[name]:
+                case "string":
+                    columns.fields[name].append(self._intern(value))
+                case "float":
+                    columns.fields[name].append(float(value))
+                case "int":
+                    columns.fields[name].append(int(value))
+        # Fields missing from this row default to zero (or the first string).
+        for name, column in columns.fields.items():
+            if len(column) == row_count:
+                column.append(0)
+
+    def write(self, record: dict[str, Any]) -> None:
+        for analyzer_name, result in record["analyzers"].items():
+            if analyzer_name not in self._analyzers:
+                self._analyzers[analyzer_name] = _AnalyzerColumns(
+                    offsets=array("q", [0] * (len(self._commits) + 1))
+                )
+            columns = self._analyzers[analyzer_name]
+            for path, value in result.items():
+                if not isinstance(value, dict):
+                    columns.scalar = True
+                    value = {"value": value}
+                columns.paths.append(self._intern(path))
+                self._append_row(columns, value)
+        self._commits.append(record["commit"])
+        self._timestamps.append(record["timestamp"])
+        for columns in self._analyzers.values():
+            columns.offsets.append(len(columns.paths))
+
+    def close(self) -> None:
+        import numpy as np  # type: ignore[import]
+
+        self._directory.mkdir(parents=True)
+        np.save(self._directory / "commits.npy", np.array(self._commits, dtype=str))
+        np.save(
+            self._directory / "timestamps.npy",
+            np.frombuffer(self._timestamps, dtype="d"),
+        )
+        encoded_strings = [string.encode() for string in self._strings]
+        np.save(
+            self._directory / "strings.npy",
+            np.frombuffer(b"".join(encoded_strings), dtype=np.uint8),
+        )
+        np.save(
+            self._directory / "string_offsets.npy",
+            np.cumsum([0, *map(len, encoded_strings)], dtype=np.int64),
+        )
+        schema: dict[str, Any] = {"analyzers": {}}
+        for analyzer_name, columns in self._analyzers.items():
+            analyzer_directory = self._directory / "analyzers" / analyzer_name
+            analyzer_directory.mkdir(parents=True)
+            np.save(
+                analyzer_directory / "offsets.npy",
+                np.frombuffer(columns.offsets, dtype="q"),
+            )
+            np.save(
+                analyzer_directory / "paths.npy",
+                np.frombuffer(columns.paths, dtype="q"),
+            )
+            for name, column in columns.fields.items():
+                np.save(
+                    analyzer_directory / f"{name}.npy",
+                    np.frombuffer(column, dtype=column.typecode),
+                )
+            schema["analyzers"][analyzer_name] = {
+                "scalar": columns.scalar,
+                "fields": columns.kinds,
+            }
+        (self._directory / "schema.json").write_text(json.dumps(schema))
+
+
+def get_totals(record: dict[str, Any]) -> dict[tuple[str, str], int | float]:
+    # Sum of each numeric field of each analyzer across files, results that
+    # aren't dicts (e.g. grep counts) are summed as a "value" field.
+    totals: defaultdict[tuple[str, str], int | float] = defaultdict(int)
+    for analyzer_name, result in record["analyzers"].items():
+        for value in result.values():
+            if not isinstance(value, dict):
+                value = {"value": value}
+            for name, field_value in value.items():
+                if isinstance(field_value, (int, float)):
+                    totals[analyzer_name, name] += field_value
+    return totals
+
+
+def get_rollup_path(path: Path) -> Path:
+    return path.with_name(f"{path.stem}.rollup.npz")
+
+
+class RollupWriter:
+    # Per-commit totals (see get_totals()) as one array per analyzer and field,
+    # so that plotting doesn't need to go through every file of every commit.
+    def __init__(self) -> None:
+        self._commits: list[str] = []
+        self._timestamps = array("d")
+        self._analyzers: dict[str, None] = {}
+        self._totals: dict[tuple[str, str], array[Any]] = {}
+
+    def write(self, record: dict[str, Any]) -> None:
+        self._analyzers |= dict.fromkeys(record["analyzers"])
+        for key, total in get_totals(record).items():
+            if key not in self._totals:
+                self._totals[key] = array(
+                    "d" if isinstance(total, float) else "q", [0] * len(self._commits)
+                )
+            column = self._totals[key]
+            column.append(float(total) if column.typecode == "d" else int(total))
+        self._commits.append(record["commit"])
+        self._timestamps.append(record["timestamp"])
+        # Fields missing from this commit are zero.
+        for column in self._totals.values():
+            if len(column) < len(self._commits):
+                column.append(0)
+
+    @classmethod
+    def load(cls, path: Path) -> RollupWriter:
+        # Continue the rollup of a previous run, when appending to its output.
+        import numpy as np  # type: ignore[import]
+
+        rollup_writer = cls()
+        with np.load(path) as arrays:
+            rollup_writer._commits = arrays["commits"].tolist()
+            rollup_writer._timestamps = array("d", arrays["timestamps"].tolist())
+            rollup_writer._analyzers = dict.fromkeys(arrays["analyzers"].tolist())
+            for key in arrays.files:
+                if "/" in key:
+                    analyzer_name, name = key.rsplit("/", 1)
+                    column = arrays[key]
+                    rollup_writer._totals[analyzer_name, name] = array(
+                        "d" if column.dtype.kind == "f" else "q", column.tolist()
+                    )
+        return rollup_writer
+
+    @property
+    def last_commit(self) -> str | None:
+        return self._commits[-1] if self._commits else None
+
+    def save(self, path: Path) -> None:
+        import numpy as np  # type: ignore[import]
+
+        arrays: dict[str, Any] = {
+            "commits": np.array(self._commits, dtype=str),
+            "timestamps": np.frombuffer(self._timestamps, dtype="d"),
+            "analyzers": np.array(list(self._analyzers), dtype=str),
+        }
+        for (analyzer_name, name), column in self._totals.items():
+            arrays[f"{analyzer_name}/{name}"] = np.frombuffer(
+                column, dtype=column.typecode
+            )
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        try:
+            with tmp_path.open("wb") as f:
+                np.savez(f, **arrays)
+            tmp_path.replace(path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+
+@dataclass
+class Checkpoint:
+    # Last commit whose record is in the output, and the size of the output up
+    # to the end of that record (i.e. without the closing bracket of JSON).
+    commit: str
+    size: int
+
+
+def get_checkpoint_path(path: Path) -> Path:
+    return path.with_name(f"{path.stem}.checkpoint.json")
+
+
+def load_checkpoint(path: Path, *, output_format: OutputFormat) -> Checkpoint | None:
+    if output_format is OutputFormat.NPY:
+        raise ValueError("Columnar npy output can't be appended to")
+    checkpoint_path = get_checkpoint_path(path)
+    if checkpoint_path.exists():
+        return Checkpoint(**json.loads(checkpoint_path.read_text()))
+    if not path.exists():
+        return None
+    # Complete output of a run that didn't append, only needed once.
+    data = path.read_bytes().rstrip()
+    match output_format:
+        case OutputFormat.JSON:
+            records = json.loads(data)
+            last_record = records[-1] if records else None
+            size = len(data) - len(b"]")
+        case OutputFormat.NDJSON:
+            last_line = data[data.rfind(b"\n") + 1 :]
+            last_record = json.loads(last_line) if last_line else None
+            size = len(data) + len(b"\n")
+    return Checkpoint(commit=last_record["commit"], size=size) if last_record else None
+
+
+class CheckpointingWriter:
+    def __init__(
+        self,
+        path: Path,
+        file: IO[str],
+        writer: JSONWriter | NDJSONWriter,
+        checkpoint: Checkpoint | None,
+    ) -> None:
+        self._path = path
+        self._file = file
+        self._writer = writer
+        self._commit = checkpoint.commit if checkpoint else None
+        self._pending_records = 0
+
+    def write(self, record: dict[str, Any]) -> None:
+        self._writer.write(record)
+        self._commit = record["commit"]
+        self._pending_records += 1
+        if self._pending_records >= CHECKPOINT_INTERVAL:
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        if not self._pending_records or not self._commit:
+            return
+        self._file.flush()
+        checkpoint_path = get_checkpoint_path(self._path)
+        tmp_path = checkpoint_path.with_name(f"{checkpoint_path.name}.tmp")
+        tmp_path.write_text(
+            json.dumps(asdict(Checkpoint(commit=self._commit, size=self._file.tell())))
+        )
+        tmp_path.replace(checkpoint_path)
+        logger.debug(f"Saved checkpoint at {self._commit}")
+        self._pending_records = 0
+
+
+@contextmanager
+def open_output_for_append(
+    path: Path, *, output_format: OutputFormat, checkpoint: Checkpoint | None
+) -> Iterator[OutputWriter]:
+    # Records are appended after the checkpoint's one, anything written after it
+    # (e.g. by a run that crashed) is dropped and analyzed again.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if checkpoint:
+        os.truncate(path, checkpoint.size)
+    with path.open("a" if checkpoint else "w") as f:
+        writer: JSONWriter | NDJSONWriter
+        match output_format:
+            case OutputFormat.JSON:
+                writer = JSONWriter(f, resume=checkpoint is not None)
+            case OutputFormat.NDJSON:
+                writer = NDJSONWriter(f)
+            case _:
+                raise ValueError(f"Can't append to {output_format.value} output")
+        checkpointing_writer = CheckpointingWriter(path, f, writer, checkpoint)
+        try:
+            yield checkpointing_writer
+        finally:
+            # Also when aborted, all records written so far are kept.
+            checkpointing_writer.checkpoint()
+            writer.close()
+
+
+@contextmanager
+def open_output(path: Path, *, output_format: OutputFormat) -> Iterator[OutputWriter]:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # The output is replaced, a previous run's checkpoint doesn't apply anymore.
+    get_checkpoint_path(path).unlink(missing_ok=True)
+    match output_format:
+        case OutputFormat.JSON:
+            # An unfinished JSON array is useless, only replace the previous
+            # output once all records have been written.
+            tmp_path = path.with_name(f"{path.name}.tmp")
+            try:
+                with tmp_path.open("w") as f:
+                    json_writer = JSONWriter(f)
+                    yield json_writer
+                    json_writer.close()
+                tmp_path.replace(path)
+            finally:
+                tmp_path.unlink(missing_ok=True)
+        case OutputFormat.NDJSON:
+            # Records written so far stay valid, even if the run is aborted.
+            with path.open("w") as f:
+                ndjson_writer = NDJSONWriter(f)
+                yield ndjson_writer
+                ndjson_writer.close()
+        case OutputFormat.NPY:
+            # Columns can only be written once all records are known, build the
+            # new directory next to the previous output and swap them at the end.
+            tmp_path = path.with_name(f"{path.name}.tmp")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            try:
+                npy_writer = NPYWriter(tmp_path)
+                yield npy_writer
+                npy_writer.close()
+                shutil.rmtree(path, ignore_errors=True)
+                tmp_path.replace(path)
+            finally:
+                shutil.rmtree(tmp_path, ignore_errors=True)
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import queue
+import resource
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from multiprocessing.sharedctypes import Synchronized
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from stats.git import Commit, checkout_async
+
+
+logger = logging.getLogger(__name__)
+
+ProcessCommitFunction = Callable[[Commit, Path | None], Any]
+
+# Every worker alternates between two checkouts, so that the next commit can be
+# checked out while the current one is being analyzed.
+CHECKOUTS_PER_WORKER = 2
+MAX_CHUNKS_PER_WORKER = 2
+
+
+async def _run_worker(
+    *,
+    chunks: asyncio.Queue[list[tuple[Commit, asyncio.Future[Any]]] | None],
+    results: dict[int, asyncio.Future[Any]],
+    executor: ProcessPoolExecutor,
+    process_commit: ProcessCommitFunction,
+    checkouts: list[Path],
+    git_semaphore: asyncio.Semaphore,
+    checkout_seconds: Synchronized[float],
+) -> None:
+    loop = asyncio.get_running_loop()
+
+    async def prepare(commit: Commit, position: int) -> Path | None:
+        if not checkouts:
+            return None
+        checkout = checkouts[position % len(checkouts)]
+        async with git_semaphore:
+            seconds = await checkout_async(checkout, commit.hash)
+        logger.debug(f"Checked out {commit.hash} in {seconds:.3f}s")
+        checkout_seconds.value += seconds
+        return checkout
+
+    try:
+        # The chunks queue is shared by all workers, each takes the next chunk
+        # once it's done with its current one.
+        while (chunk := await chunks.get()) is not None:
+            prepared = asyncio.create_task(prepare(chunk[0][0], 0))
+            for position, (commit, result) in enumerate(chunk):
+                tmp_repository = await prepared
+                if position + 1 < len(chunk):
+                    prepared = asyncio.create_task(
+                        prepare(chunk[position + 1][0], position + 1)
+                    )
+                result.set_result(
+                    await loop.run_in_executor(
+                        executor, process_commit, commit, tmp_repository
+                    )
+                )
+    except Exception as e:
+        # Don't leave anyone waiting for results that will never arrive.
+        for result in results.values():
+            if not result.done():
+                result.set_exception(e)
+        raise
+
+
+async def _run(
+    commits: list[Commit],
+    *,
+    output: queue.Queue[Any],
+    process_commit: ProcessCommitFunction,
+    checkouts: list[Path],
+    processes: int,
+    chunk_size: int,
+    max_git_processes: int,
+    initializer: Callable[..., None],
+    initargs: tuple[Any, ...],
+    checkout_seconds: Synchronized[float],
+    checkout_bytes: Synchronized[int],
+) -> None:
+    loop = asyncio.get_running_loop()
+    indexed_commits = list(enumerate(commits))
+    pending_chunks = iter(
+        [
+            indexed_commits[start : start + chunk_size]
+            for start in range(0, len(indexed_commits), chunk_size)
+        ]
+    )
+    # Only chunks that are being worked on (or about to be) have futures, and
+    # results are dropped as soon as they're handed over, so that memory stays
+    # bounded no matter how many commits there are.
+    chunks: asyncio.Queue[list[tuple[Commit, asyncio.Future[Any]]] | None] = (
+        asyncio.Queue()
+    )
+    results: dict[int, asyncio.Future[Any]] = {}
+
+    def dispatch_chunk() -> None:
+        chunk = next(pending_chunks, None)
+        if chunk is None:
+            return
+        for index, _ in chunk:
+            results[index] = loop.create_future()
+        chunks.put_nowait([(commit, results[index]) for index, commit in chunk])
+
+    git_semaphore = asyncio.Semaphore(max_git_processes)
+    start_blocks = resource.getrusage(resource.RUSAGE_CHILDREN).ru_oublock
+
+    with ExitStack() as stack:
+        # One single-process executor per worker, so that each of them keeps
+        # processing contiguous commits (see process_commit_init()).
+        workers = []
+        for worker in range(processes):
+            start = worker * CHECKOUTS_PER_WORKER
+            executor = stack.enter_context(
+                ProcessPoolExecutor(
+                    max_workers=1, initializer=initializer, initargs=initargs
+                )
+            )
+            workers.append(
+                asyncio.create_task(
+                    _run_worker(
+                        chunks=chunks,
+                        results=results,
+                        executor=executor,
+                        process_commit=process_commit,
+                        checkouts=checkouts[start : start + CHECKOUTS_PER_WORKER],
+                        git_semaphore=git_semaphore,
+                        checkout_seconds=checkout_seconds,
+                    )
+                )
+            )
+        # Every worker can have one chunk waiting while it's processing another.
+        for _ in range(processes * MAX_CHUNKS_PER_WORKER):
+            dispatch_chunk()
+        for index in range(len(commits)):
+            result = await results[index]
+            del results[index]
+            if (index + 1) % chunk_size == 0:
+                dispatch_chunk()
+            # Wait for the records to be written when they're falling behind.
+            await asyncio.to_thread(output.put, result)
+        # All chunks are done, let the workers finish.
+        for _ in workers:
+            chunks.put_nowait(None)
+        await asyncio.gather(*workers)
+        # Only git processes have been waited for so far, the executors'
+        # processes are still running.
+        blocks = resource.getrusage(resource.RUSAGE_CHILDREN).ru_oublock - start_blocks
+        checkout_bytes.value += blocks * 512
+
+
+def run_pipeline(
+    commits: list[Commit],
+    *,
+    process_commit: ProcessCommitFunction,
+    checkouts: list[Path],
+    processes: int,
+    chunk_size: int,
+    max_git_processes: int,
+    initializer: Callable[..., None],
+    initargs: tuple[Any, ...],
+    checkout_seconds: Synchronized[float],
+    checkout_bytes: Synchronized[int],
+) -> Iterator[Any]:
+    # The event loop runs in a separate thread, results are handed over in the
+    # order of commits, like Pool.imap() does.
+    output: queue.Queue[Any] = queue.Queue(maxsize=processes)
+    done = object()
+
+    def run() -> None:
+        try:
+            asyncio.run(
+                _run(
+                    commits,
+                    output=output,
+                    process_commit=process_commit,
+                    checkouts=checkouts,
+                    processes=processes,
+                    chunk_size=chunk_size,
+                    max_git_processes=max_git_processes,
+                    initializer=initializer,
+                    initargs=initargs,
+                    checkout_seconds=checkout_seconds,
+                    checkout_bytes=checkout_bytes,
+                )
+            )
+        except BaseException as e:
+            output.put(e)
+        else:
+            output.put(done)
+
+    threading.Thread(target=run, daemon=True).start()
+    while (result := output.get()) is not done:
+        if isinstance(result, BaseException):
+            raise result
+        yield result
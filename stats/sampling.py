@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Callable, Collection, Iterator
+
+from stats.config import Config
+from stats.git import Commit
+from stats.output import get_totals
+
+
+logger = logging.getLogger(__name__)
+
+
+def _get_difference(
+    a: dict[tuple[str, str], int | float], b: dict[tuple[str, str], int | float]
+) -> float:
+    # Largest relative change of any total between two commits.
+    return max(
+        (
+            abs(a.get(key, 0) - b.get(key, 0))
+            / max(abs(a.get(key, 0)), abs(b.get(key, 0)), 1)
+            for key in a.keys() | b.keys()
+        ),
+        default=0.0,
+    )
+
+
+def sample_adaptively(
+    commits: list[Commit],
+    analyze_commits: Callable[[list[Commit]], Iterator[dict[str, Any]]],
+    *,
+    adaptive_sampling: Config.AdaptiveSampling,
+    file_analyzer_names: Collection[str],
+) -> Iterator[dict[str, Any]]:
+    # Start with evenly spaced commits, then keep analyzing the commit in the
+    # middle of every interval where the totals change by more than the
+    # threshold, until the budget is used up or there's nothing left to split.
+    # Only file analyzers count, their totals describe the whole tree, whereas
+    # e.g. grep_commits only counts matches in a single commit's message.
+    budget = min(adaptive_sampling.max_commits or len(commits), len(commits))
+    initial_count = min(adaptive_sampling.initial_commits, budget)
+    if initial_count < 1:
+        return
+    step = (len(commits) - 1) / max(initial_count - 1, 1)
+    indices = sorted({round(position * step) for position in range(initial_count)})
+
+    records: dict[int, dict[str, Any]] = {}
+    totals: dict[int, dict[tuple[str, str], int | float]] = {}
+    while indices:
+        logger.info(f"Analyzing {len(indices)} sampled commits")
+        for index, record in zip(
+            indices, analyze_commits([commits[index] for index in indices]), strict=True
+        ):
+            records[index] = record
+            totals[index] = {
+                key: total
+                for key, total in get_totals(record).items()
+                if key[0] in file_analyzer_names
+            }
+
+        analyzed_indices = sorted(records)
+        differences = {
+            (start + end) // 2: difference
+            for start, end in zip(analyzed_indices, analyzed_indices[1:])
+            if end - start > 1
+            and (difference := _get_difference(totals[start], totals[end]))
+            > adaptive_sampling.threshold
+        }
+        # Refine the largest changes first if not all of them fit the budget.
+        indices = sorted(
+            sorted(differences, key=lambda index: differences[index], reverse=True)[
+                : budget - len(records)
+            ]
+        )
+
+    logger.info(f"Analyzed {len(records)} of {len(commits)} commits")
+    for index in sorted(records):
+        yield records[index]
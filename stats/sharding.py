@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from multiprocessing.managers import BaseManager
+from pathlib import Path
+from typing import Any, Iterator, cast
+
+from stats.config import OutputFormat
+from stats.git import Commit
+from stats.output import (
+    RollupWriter,
+    get_checkpoint_path,
+    get_rollup_path,
+    open_output,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Shard:
+    index: int
+    count: int
+
+    def select(self, commits: list[Commit]) -> list[Commit]:
+        # Contiguous ranges, so that consecutive checkouts stay small steps.
+        start = len(commits) * self.index // self.count
+        end = len(commits) * (self.index + 1) // self.count
+        return commits[start:end]
+
+
+def parse_shard(value: str) -> Shard:
+    # "i/N", the i-th (starting at 0) of N shards.
+    index, count = map(int, value.split("/"))
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid shard {value}")
+    return Shard(index=index, count=count)
+
+
+def get_shard_path(path: Path, shard: Shard) -> Path:
+    # Shards are always NDJSON, which can be merged one record at a time.
+    return path.with_name(f"{path.stem}.shard-{shard.index}-of-{shard.count}.ndjson")
+
+
+def get_shard_manifest_path(path: Path, shard: Shard) -> Path:
+    return path.with_name(f"{path.stem}.shard-{shard.index}-of-{shard.count}.json")
+
+
+def save_shard_manifest(path: Path, shard: Shard, commits: list[Commit]) -> None:
+    # The commits a shard is supposed to contain, for merge_shards() to check.
+    manifest_path = get_shard_manifest_path(path, shard)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest_path.write_text(
+        json.dumps(
+            {
+                "index": shard.index,
+                "count": shard.count,
+                "commits": [commit.hash for commit in commits],
+            }
+        )
+    )
+
+
+def _load_shard_records(shard_path: Path) -> Iterator[dict[str, Any]]:
+    with shard_path.open() as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _remove_output(path: Path) -> None:
+    # npy output is a directory, all others a file.
+    if path.is_dir():
+        shutil.rmtree(path)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def merge_shards(path: Path, *, output_format: OutputFormat, rollup: bool) -> None:
+    manifests = [
+        json.loads(manifest_path.read_text())
+        for manifest_path in path.parent.glob(f"{path.stem}.shard-*-of-*.json")
+    ]
+    counts = {manifest["count"] for manifest in manifests}
+    if len(counts) != 1:
+        raise ValueError(
+            f"Expected the shards of a single run next to {path}, found shard "
+            f"counts {sorted(counts)}"
+        )
+    count = counts.pop()
+    manifests_by_index = {manifest["index"]: manifest for manifest in manifests}
+    if missing := [index for index in range(count) if index not in manifests_by_index]:
+        raise ValueError(f"Shards {missing} of {count} are missing")
+    shards = [Shard(index=index, count=count) for index in range(count)]
+
+    # Check everything that can be checked before writing anything.
+    seen_commits: set[str] = set()
+    for shard in shards:
+        expected_commits = manifests_by_index[shard.index]["commits"]
+        if duplicates := seen_commits.intersection(expected_commits):
+            raise ValueError(
+                f"Shard {shard.index} overlaps with previous ones: "
+                f"{sorted(duplicates)[:5]}"
+            )
+        seen_commits.update(expected_commits)
+        if not get_shard_path(path, shard).exists():
+            raise ValueError(f"Output of shard {shard.index} is missing")
+
+    logger.info(f"Merging {len(shards)} shards into {path}")
+    # The records of each shard are only checked while they're written, the
+    # previous output is kept until all of them turned out to be fine.
+    tmp_path = path.with_name(f"{path.name}.merge")
+    _remove_output(tmp_path)
+    rollup_writer = RollupWriter() if rollup else None
+    try:
+        with open_output(tmp_path, output_format=output_format) as output:
+            for shard in shards:
+                expected_commits = manifests_by_index[shard.index]["commits"]
+                written_commits = 0
+                for record in _load_shard_records(get_shard_path(path, shard)):
+                    if (
+                        written_commits >= len(expected_commits)
+                        or record["commit"] != expected_commits[written_commits]
+                    ):
+                        raise ValueError(
+                            f"Unexpected commit {record['commit']} in shard "
+                            f"{shard.index}"
+                        )
+                    output.write(record)
+                    if rollup_writer:
+                        rollup_writer.write(record)
+                    written_commits += 1
+                if written_commits < len(expected_commits):
+                    raise ValueError(
+                        f"Shard {shard.index} is incomplete, it only contains "
+                        f"{written_commits} of {len(expected_commits)} commits"
+                    )
+        if path.is_dir():
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+    finally:
+        _remove_output(tmp_path)
+    # The merged output isn't appended to where a previous run left off.
+    get_checkpoint_path(path).unlink(missing_ok=True)
+    if rollup_writer:
+        rollup_path = get_rollup_path(path)
+        logger.info(f"Saving per-commit totals to {rollup_path}")
+        rollup_writer.save(rollup_path)
+    logger.info(f"Merged {len(seen_commits)} commits")
+
+
+# Work queue for nodes that pull batches of commits from a coordinator, and send
+# back their results.
+class _CoordinatorManager(BaseManager): ...
+
+
+class _WorkerManager(BaseManager): ...
+
+
+_WorkerManager.register("get_batches")
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+class _BatchQueue:
+    # Batches that workers haven't sent results for within the timeout (e.g.
+    # because they died) are handed out again, whichever results arrive first
+    # are used.
+    def __init__(self, batches: list[list[Commit]], *, timeout: int) -> None:
+        self._batches = batches
+        self._timeout = timeout
+        self._pending = deque(range(len(batches)))
+        self._deadlines: dict[int, float] = {}
+        self._finished: set[int] = set()
+        self._condition = threading.Condition()
+        self.results: queue.Queue[tuple[int, list[dict[str, Any]]]] = queue.Queue()
+
+    def take(self) -> tuple[int, list[Commit]] | None:
+        # None once all batches are finished. While others are still being
+        # analyzed, this waits in case they have to be handed out again.
+        with self._condition:
+            while not self._pending:
+                if not self._deadlines:
+                    return None
+                now = time.monotonic()
+                for index, deadline in list(self._deadlines.items()):
+                    if deadline <= now:
+                        logger.warning(
+                            f"No results for batch {index + 1} after "
+                            f"{self._timeout}s, handing it out again"
+                        )
+                        del self._deadlines[index]
+                        self._pending.append(index)
+                if not self._pending:
+                    self._condition.wait(min(self._deadlines.values()) - now)
+            index = self._pending.popleft()
+            self._deadlines[index] = time.monotonic() + self._timeout
+            return index, self._batches[index]
+
+    def submit(self, index: int, records: list[dict[str, Any]]) -> None:
+        with self._condition:
+            if index in self._finished:
+                logger.info(f"Ignoring duplicate results of batch {index + 1}")
+                return
+            self._finished.add(index)
+            self._deadlines.pop(index, None)
+            if index in self._pending:
+                self._pending.remove(index)
+            self._condition.notify_all()
+        self.results.put((index, records))
+
+
+def coordinate(
+    batches: list[list[Commit]], *, address: str, authkey: str, batch_timeout: int
+) -> Iterator[dict[str, Any]]:
+    # Records are yielded in the order of commits, as soon as all earlier
+    # batches are done.
+    batch_queue = _BatchQueue(batches, timeout=batch_timeout)
+    _CoordinatorManager.register("get_batches", callable=lambda: batch_queue)
+    manager = _CoordinatorManager(
+        address=parse_address(address), authkey=authkey.encode()
+    )
+    server = manager.get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Waiting for workers to analyze {len(batches)} batches on {address}")
+
+    finished_batches: dict[int, list[dict[str, Any]]] = {}
+    for next_index in range(len(batches)):
+        while next_index not in finished_batches:
+            index, records = batch_queue.results.get()
+            logger.info(f"Received batch {index + 1}/{len(batches)}")
+            finished_batches[index] = records
+        yield from finished_batches.pop(next_index)
+
+
+class WorkerConnection:
+    def __init__(self, *, address: str, authkey: str) -> None:
+        manager = _WorkerManager(
+            address=parse_address(address), authkey=authkey.encode()
+        )
+        manager.connect()
+        self._batches = cast(_BatchQueue, manager.get_batches())  # type: ignore[attr-defined]
+
+    def get_batches(self) -> Iterator[tuple[int, list[Commit]]]:
+        # Batches of the coordinator's commits, until all of them are done.
+        while (batch := self._batches.take()) is not None:
+            yield batch
+
+    def submit(self, index: int, records: list[dict[str, Any]]) -> None:
+        self._batches.submit(index, records)
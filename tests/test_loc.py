@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from typing import Any
+
+from stats.analyzers.loc import Language, count_lines, get_language
+
+
+def _get_language(path: str) -> Language:
+    language = get_language(path)
+    assert language
+    return language
+
+
+def _count(path: str, content: bytes) -> dict[str, Any]:
+    result = count_lines(_get_language(path), content)
+    return {
+        key: result[key] for key in ("lines", "code", "comment", "blank", "complexity")
+    }
+
+
+def test_lua_block_comment() -> None:
+    assert _count("a.lua", b"--[[ a\nb\nc\n]]\nx = 1\n") == {
+        "lines": 5,
+        "code": 1,
+        "comment": 4,
+        "blank": 0,
+        "complexity": 0,
+    }
+
+
+def test_lua_line_comment() -> None:
+    assert _count("a.lua", b"-- a\nx = 1 -- b\n")["comment"] == 1
+
+
+def test_c_comments() -> None:
+    assert _count("a.c", b"/* a\n\n b */\nint x; // c\n\n// d\n") == {
+        "lines": 6,
+        "code": 1,
+        "comment": 3,
+        "blank": 2,
+        "complexity": 0,
+    }
+
+
+def test_unterminated_block_comment() -> None:
+    assert _count("a.c", b"int x;\n/* a\nb\n")["comment"] == 2
+
+
+def test_complexity_ignores_comments() -> None:
+    assert _count("a.py", b"x = 1  # if a and b\n")["complexity"] == 0
+    assert _count("a.c", b"x = 1; /* if (a && b) */\n")["complexity"] == 0
+
+
+def test_complexity() -> None:
+    assert _count("a.py", b"if a and b:  # or\n    pass\n")["complexity"] == 2
+    assert _count("a.c", b"if (a && b || c) {}\n")["complexity"] == 3
+    # Only whole words.
+    assert _count("a.py", b"iffy = format\n")["complexity"] == 0